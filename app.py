@@ -1,8 +1,28 @@
 # app.py
 import streamlit as st
-from main import HTMLGenerator, extract_image_info, get_image_dimensions
+from main import HTMLGenerator, create_full_preview_html, extract_image_info, get_image_dimensions
+from backends import make_backend
+from blobs import BlobRef, BlobStore, SessionBlobCache
+from cache import GenerationCache
+from cascade import STAGE_MODELS, ModelCascade
+from similarity import SimilarityIndex
+from client import client_stats
+from tiling import TALL_RATIO, is_tall
+from export import build_asset_bundle, write_asset_bundle
+from optimize import optimize_html
 import base64
+import metrics
+import os
 import re
+import time
+from contextlib import contextmanager
+
+# Seconds between Step 2 progress refreshes while the analysis job runs in the background
+JOB_POLL_SECONDS = 0.75
+# Seconds between checks for a finished background refinement
+REFINE_POLL_SECONDS = 2.0
+# Single-file HTML above this size is not put in the editor unless asked for
+INLINE_EDIT_BYTES = 1024 * 1024
 
 # Page setup
 st.set_page_config(
@@ -71,6 +91,16 @@ def initialize_session_state():
         st.session_state.step = 1
     if 'analysis_done' not in st.session_state:
         st.session_state.analysis_done = False
+    if 'use_cache' not in st.session_state:
+        st.session_state.use_cache = True
+    if 'use_tiling' not in st.session_state:
+        st.session_state.use_tiling = True
+    if 'use_cascade' not in st.session_state:
+        st.session_state.use_cascade = os.environ.get("MOCKUP_CASCADE", "0") == "1"
+    if 'optimize_output' not in st.session_state:
+        st.session_state.optimize_output = os.environ.get("MOCKUP_OPTIMIZE", "1") != "0"
+    if 'similarity_distance' not in st.session_state:
+        st.session_state.similarity_distance = get_similarity_index().max_distance
 
 def get_step_status(current_step, step_number):
     """Determine CSS class for step indicator"""
@@ -114,25 +144,495 @@ def display_image_upload_section(image_info):
     
     return uploaded_images
 
-def create_full_preview_html(html_content, original_width, original_height):
-    """Wrap the HTML content to display at full size without scrolling"""
-    # Calculate a scaled height for the iframe to show full content
-    # Use the original height but cap it at 800px for reasonable display
-    display_height = min(original_height, 800)
-    
-    # Create a wrapper that shows the full HTML without internal scrolling
-    wrapper_html = f"""
-    <div style="width: 100%; height: {display_height}px; overflow: visible; transform-origin: top left;">
-        <div style="transform: scale(0.8); transform-origin: top left; width: 125%;">
-            {html_content}
-        </div>
-    </div>
+def create_final_preview_html(final_html, display_height):
+    """Wrap the final HTML for the Step 4 side-by-side preview"""
+    return f"""
+                    <div style="width: 100%; height: {display_height}px; overflow: visible; border: 1px solid #ddd; border-radius: 10px; padding: 10px; background: white;">
+                        <div style="transform: scale(0.7); transform-origin: top left; width: 142.857%;">
+                            {final_html}
+                        </div>
+                    </div>
+                    """
+
+# Reruns with unchanged inputs hit these caches instead of redoing the work.
+# Inputs and outputs are BlobRef handles: they hash cheaply, being content
+# addressed, and keep the multi-megabyte HTML on disk rather than in the cache.
+# Call the ones returning BlobRefs through cached_blobs(), which keeps those
+# blobs alive and rebuilds entries whose blobs were garbage collected.
+
+def blob_refs(value):
+    """Every BlobRef inside a cached result (nested tuples, lists and dicts)"""
+    if isinstance(value, BlobRef):
+        return [value]
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (tuple, list)):
+        return [ref for item in value for ref in blob_refs(item)]
+    return []
+
+def cached_blobs(func, *args):
+    """Call a cached function returning BlobRefs, touching them so gc() keeps them
+
+    The cache outlives the blob TTL and is shared by every session, so a hit
+    can name blobs gc() already deleted; that function's cache is then
+    cleared and the result rebuilt.
+    """
+    result = func(*args)
+    if get_blob_store().touch(blob_refs(result)):
+        func.clear()
+        result = func(*args)
+    return result
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def cached_optimized_html(html_ref):
+    """Placeholder HTML with styles deduplicated and minified; returns (ref, report)"""
+    html, report = optimize_html(get_blob_store().read_text(html_ref))
+    return get_blob_store().put(html, html_ref.name, html_ref.mime_type), report
+
+def output_html():
+    """(ref, report) of the placeholder HTML previews and downloads are built from
+
+    The stored HTML stays as generated, since revision relies on its markers;
+    report is None when optimization is switched off.
     """
-    return wrapper_html, display_height
+    if not st.session_state.optimize_output:
+        return st.session_state.html_with_placeholders, None
+    return cached_blobs(cached_optimized_html, st.session_state.html_with_placeholders)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def cached_preview_html(html_ref, original_width, original_height):
+    return create_full_preview_html(get_blob_store().read_text(html_ref), original_width, original_height)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def cached_final_preview_html(final_ref, display_height):
+    preview_html = create_final_preview_html(get_blob_store().read_text(final_ref), display_height)
+    return get_blob_store().put(preview_html, 'preview.html', 'text/html')
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def cached_final_html(html_ref, uploaded_images, image_info):
+    """Inline the uploaded images; returns (final_ref, issues)"""
+    store = get_blob_store()
+    issues = []
+    final_html = get_html_generator().replace_image_placeholders(
+        store.read_text(html_ref),
+        {img_id: store.open(ref) for img_id, ref in uploaded_images.items()},
+        issues=issues,
+        image_info=image_info
+    )
+    return store.put(final_html, 'website.html', 'text/html'), issues
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def cached_asset_bundle(html_ref, uploaded_images, image_info):
+    """Bundle index.html and image files; assets come back as {path: BlobRef}"""
+    store = get_blob_store()
+    index_html, assets, issues, stats = build_asset_bundle(
+        store.read_text(html_ref),
+        {img_id: store.open(ref) for img_id, ref in uploaded_images.items()},
+        image_info=image_info
+    )
+    asset_refs = {path: store.put(data, path) for path, data in assets.items()}
+    return index_html, asset_refs, issues, stats
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_bundle_archive(index_html, asset_refs):
+    """Zip of index_html and the {path: BlobRef} assets, written straight to the blob store"""
+    store = get_blob_store()
+    return store.put_stream(
+        lambda f: write_asset_bundle(index_html, asset_refs, f, open_asset=store.open),
+        'website.zip', 'application/zip'
+    )
+
+@contextmanager
+def timed(stage):
+    """Record how long a block of this rerun took, as a rerun timing and an app_<stage> span"""
+    started = time.perf_counter()
+    try:
+        with metrics.span(f"app_{stage}", step=st.session_state.get('step')):
+            yield
+    finally:
+        st.session_state.stage_timings[stage] = time.perf_counter() - started
+
+def display_rerun_timing(timing_slot, started):
+    """Per-rerun timing readout in the sidebar"""
+    total_ms = (time.perf_counter() - started) * 1000
+    stages = " · ".join(f"{stage} {seconds * 1000:.0f} ms"
+                        for stage, seconds in st.session_state.get('stage_timings', {}).items())
+    setup = client_stats()
+    if setup['sdk_import_ms'] is None or setup['configure_ms'] is None:
+        setup_text = "Gemini SDK not configured yet"
+    else:
+        init_ms = sum(ms for ms in setup['model_init_ms'].values() if ms)
+        setup_text = (f"Gemini setup (once per process): import {setup['sdk_import_ms']:.0f} ms, "
+                      f"configure {setup['configure_ms']:.0f} ms, models {init_ms:.0f} ms · "
+                      f"{setup['model_lookups']} calls reused the shared client")
+    timing_slot.caption(f"⏱️ Rerun #{st.session_state.get('rerun_count', 0)}: {total_ms:.0f} ms"
+                        + (f" ({stages})" if stages else "")
+                        + f"  \n🔌 {setup_text}")
+
+def render_stream_progress(parser, status_slot, table_slot, preview_slot, original_width, original_height, elapsed):
+    """Refresh the Step 2 live preview from the partially generated HTML"""
+    found = len(parser.image_info)
+    expected = f"/{parser.total_images}" if parser.total_images is not None else ""
+    status_slot.info(f"✍️ Generating... {elapsed:.1f}s · {len(parser.text) / 1024:.1f} KB · "
+                     f"{found}{expected} image areas detected")
+    if parser.image_info:
+        table_slot.table([
+            {'Area': img_id, 'Size': f"{info['width']} × {info['height']}px", 'Type': info['description']}
+            for img_id, info in sorted(parser.image_info.items())
+        ])
+    with preview_slot.container():
+        preview_html, preview_height = create_full_preview_html(parser.text, original_width, original_height)
+        st.components.v1.html(preview_html, height=preview_height, scrolling=False)
+
+def current_analysis_job(generator, original_width, original_height):
+    """This session's Step 2 job, submitting it on first use"""
+    job = None
+    if 'analysis_job_id' in st.session_state:
+        job = generator.jobs.get(st.session_state.analysis_job_id)
+    if job is None:
+        # With the cascade on, Step 2 only waits for the fast draft model
+        submit = get_model_cascade().submit_draft if st.session_state.use_cascade else generator.submit_analysis
+        job = submit(
+            design_file(), original_width, original_height,
+            use_cache=st.session_state.use_cache,
+            tiled=st.session_state.use_tiling and is_tall(original_width, original_height)
+        )
+        st.session_state.analysis_job_id = job.id
+    return job
+
+def submit_refinement(draft_html):
+    """Start refining the draft with the stronger model in the background"""
+    original_width = st.session_state.original_width
+    original_height = st.session_state.original_height
+    job = get_model_cascade().submit_refinement(
+        design_file(), original_width, original_height, draft_html,
+        use_cache=st.session_state.use_cache,
+        tiled=st.session_state.use_tiling and is_tall(original_width, original_height)
+    )
+    st.session_state.refine_job_id = job.id
+
+@st.fragment(run_every=REFINE_POLL_SECONDS)
+def display_refinement_status():
+    """Swap in the refined HTML once the background refinement finishes"""
+    if 'refine_job_id' not in st.session_state:
+        return
+    job = get_html_generator().jobs.get(st.session_state.refine_job_id)
+    if job is None:
+        del st.session_state.refine_job_id
+        return
+    if not job.done:
+        st.info(f"🔬 Refining the layout with {get_model_cascade().refine.model_name} in the background "
+                f"({job.run_seconds:.0f}s) — you can keep uploading images meanwhile")
+        return
+    del st.session_state.refine_job_id
+    try:
+        refined_html = job.wait()
+    except Exception as e:
+        st.session_state.payload_report = f"⚠️ Refinement failed, keeping the draft: {str(e)}"
+        st.rerun()
+    report = job.progress['reconcile']
+    st.session_state.html_with_placeholders = get_blob_store().put(refined_html, 'index.html', 'text/html')
+    st.session_state.image_info = extract_image_info(refined_html)
+    get_similarity_index().add(design_file(), refined_html, get_model_cascade().refine.model_name)
+    st.session_state.payload_report = (
+        f"🔬 Refined by {get_model_cascade().refine.model_name} in {job.progress['seconds']:.1f}s · "
+        f"{len(report['matched'])} image areas kept their numbers"
+        + (f", {len(report['added'])} new" if report['added'] else "")
+        + (f", {len(report['dropped'])} removed" if report['dropped'] else "")
+    )
+    # New image areas need uploads before the final HTML can be built
+    uploaded = st.session_state.get('uploaded_images', {})
+    if st.session_state.step == 4 and set(st.session_state.image_info) - set(uploaded):
+        st.session_state.step = 3
+    st.rerun()
+
+def render_job_progress(job, status_slot, table_slot, preview_slot, original_width, original_height):
+    """Show where this session's analysis job is: queued, tiled bands, or the live stream"""
+    if job.state == 'queued':
+        ahead = get_html_generator().jobs.position(job)
+        status_slot.info(f"⏳ Waiting for a free worker ({ahead} ahead in the queue, {job.wait_seconds:.1f}s so far)...")
+    elif 'bands' in job.progress:
+        status_slot.info(f"Analyzing your {original_width}×{original_height} pixel design as "
+                         f"{job.progress['bands']} bands in parallel... {job.run_seconds:.1f}s")
+    elif 'parser' in job.progress:
+        render_stream_progress(job.progress['parser'].snapshot(), status_slot, table_slot, preview_slot,
+                               original_width, original_height, job.run_seconds)
+    else:
+        status_slot.info(f"Analyzing your {original_width}×{original_height} pixel design...")
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def display_analysis_progress(original_width, original_height):
+    """Refresh the running analysis job's progress without rerunning the whole page"""
+    job = get_html_generator().jobs.get(st.session_state.get('analysis_job_id'))
+    if job is None or job.done:
+        # The full rerun collects the result (or resubmits an expired job)
+        st.rerun()
+    with timed("analysis"):
+        render_job_progress(job, st.empty(), st.empty(), st.empty(), original_width, original_height)
+
+def analysis_report(job):
+    """Payload and timing summary of a finished analysis job"""
+    wait = f" · queued {job.wait_seconds:.1f}s" if job.wait_seconds >= 0.1 else ""
+    shared = f" · shared by {job.subscribers} sessions" if job.subscribers > 1 else ""
+    if 'bands' in job.progress:
+        return f"🧩 Tiled analysis: {job.progress['bands']} bands in {job.run_seconds:.1f}s{wait}{shared}"
+    report = payload_report(job.progress['payload'])
+    if 'first_chunk_seconds' in job.progress:
+        report += f" · first chunk {job.progress['first_chunk_seconds']:.1f}s, total {job.run_seconds:.1f}s"
+    return report + wait + shared
+
+def display_revision_section():
+    """Upload a revised design and regenerate only the regions that changed"""
+    with st.expander("🔁 Upload a revised design"):
+        revised_file = st.file_uploader(
+            "Revised design image",
+            type=['jpg', 'jpeg', 'png', 'webp'],
+            key="revision_upload"
+        )
+        st.caption("Only sections whose pixels changed are sent to the AI again; "
+                   "existing image areas keep their numbers and uploads.")
+        if not revised_file or not st.button("♻️ Regenerate Changed Regions", use_container_width=True):
+            return
+        revised_width, revised_height = get_image_dimensions(revised_file)
+        try:
+            with st.spinner("Comparing designs and regenerating changed regions..."):
+                with timed("revision"):
+                    html_with_placeholders, report = get_html_generator().revise_html(
+                        placeholder_html(),
+                        design_file(),
+                        revised_file,
+                        revised_width,
+                        revised_height,
+                        use_cache=st.session_state.use_cache
+                    )
+        except Exception as e:
+            st.error(f"❌ Revision failed: {str(e)}")
+            return
+
+        # A refinement of the previous design would overwrite the revision
+        st.session_state.pop('refine_job_id', None)
+        st.session_state.html_with_placeholders = get_blob_store().put(html_with_placeholders, 'index.html', 'text/html')
+        st.session_state.image_info = extract_image_info(html_with_placeholders)
+        get_similarity_index().add(revised_file, html_with_placeholders, get_html_generator().model_name)
+        st.session_state.original_design = get_blob_store().put_file(revised_file)
+        st.session_state.original_width = revised_width
+        st.session_state.original_height = revised_height
+        if report['mode'] == 'incremental':
+            st.session_state.payload_report = (
+                f"♻️ Revision: regenerated {len(report['regenerated'])} of {report['sections']} sections "
+                f"({report['changed_fraction']:.0%} of rows changed) in {report['seconds']:.1f}s"
+            )
+        elif report['mode'] == 'unchanged':
+            st.session_state.payload_report = "♻️ Revision: no visible changes, HTML kept as is"
+        else:
+            st.session_state.payload_report = (
+                f"♻️ Revision: full regeneration ({report['reason']}) in {report['seconds']:.1f}s"
+            )
+        # Uploads for areas the revision removed would otherwise fill nothing
+        uploaded = {img_id: ref for img_id, ref in st.session_state.get('uploaded_images', {}).items()
+                    if img_id in st.session_state.image_info}
+        st.session_state.uploaded_images = uploaded
+        # New image areas need uploads before the final HTML can be built
+        if st.session_state.step == 4 and set(st.session_state.image_info) - set(uploaded):
+            st.session_state.step = 3
+        st.rerun()
+
+def payload_report(payload):
+    """Summarize the upload payload before/after preprocessing"""
+    return (
+        f"📦 Upload payload: {payload['original_payload_bytes'] / 1024:.0f} KB → "
+        f"{payload['payload_bytes'] / 1024:.0f} KB ({payload['mime_type']}, "
+        f"{payload['width']}×{payload['height']}px sent) · "
+        f"encode {payload['original_encode_seconds'] * 1000:.0f} ms → {payload['encode_seconds'] * 1000:.0f} ms"
+    )
+
+def display_metrics_sidebar():
+    """Optional panel with per-stage timings, counters and trace exports"""
+    with st.sidebar:
+        if not st.checkbox("📈 Show pipeline metrics", key="show_metrics"):
+            return
+        queue = get_html_generator().jobs.stats()
+        st.caption(f"Jobs: {queue['queued']}/{queue['max_pending']} queued · "
+                   f"{queue['running']}/{queue['workers']} running · avg wait {queue['avg_wait_seconds']:.1f}s · "
+                   f"{queue['coalesced']} coalesced · {queue['failed']} failed")
+        spans, counters = metrics.REGISTRY.snapshot()
+        if spans:
+            st.table([
+                {
+                    'Stage': name,
+                    'Count': stats['count'],
+                    'Avg ms': round(stats['sum'] / stats['count'] * 1000, 1),
+                    'Max ms': round(stats['max'] * 1000, 1),
+                    'Errors': stats['errors']
+                }
+                for name, stats in sorted(spans.items())
+            ])
+        for (name, labels), value in sorted(counters.items()):
+            label_text = ", ".join(f"{key}={val}" for key, val in labels)
+            st.caption(f"{name}{f' ({label_text})' if label_text else ''}: {value:,}")
+        st.download_button("⬇️ Traces (JSONL)", metrics.REGISTRY.traces_jsonl(),
+                           file_name="traces.jsonl", mime="application/jsonl", use_container_width=True)
+        st.download_button("⬇️ Metrics (Prometheus)", metrics.REGISTRY.prometheus_text(),
+                           file_name="metrics.prom", mime="text/plain", use_container_width=True)
+
+@st.cache_resource
+def start_metrics_endpoint():
+    """Serve /metrics once per process when MOCKUP_METRICS_PORT is set"""
+    port = os.environ.get("MOCKUP_METRICS_PORT")
+    if port:
+        metrics.start_metrics_server(int(port))
+    return port
+
+def display_cache_sidebar():
+    """Show the generation cache switch and its hit/miss counters"""
+    with st.sidebar:
+        st.markdown("### ⚡ Generation Cache")
+        st.session_state.use_cache = st.checkbox(
+            "Reuse previous generations",
+            value=st.session_state.use_cache,
+            help="Identical mockups skip the Gemini call and load the stored HTML"
+        )
+        stats = get_generation_cache().stats()
+        st.caption(f"Hits: {stats['hits']} · Misses: {stats['misses']} · "
+                   f"Entries: {stats['entries']} ({stats['bytes'] / 1024:.0f} KB)")
+        st.session_state.use_tiling = st.checkbox(
+            "Tiled analysis for tall pages",
+            value=st.session_state.use_tiling,
+            help=f"Pages taller than {TALL_RATIO:g}× their width are analyzed as parallel bands"
+        )
+        st.session_state.use_cascade = st.checkbox(
+            "Fast draft, refine in background",
+            value=st.session_state.use_cascade,
+            help=f"{STAGE_MODELS['draft']} finds the layout and image areas first so uploads can start; "
+                 f"{STAGE_MODELS['refine']} refines it in the background"
+        )
+        st.session_state.optimize_output = st.checkbox(
+            "Optimize output HTML",
+            value=st.session_state.optimize_output,
+            help="Turn repeated inline styles into classes, minify, and keep only above-the-fold CSS in <head>"
+        )
+        index_stats = get_similarity_index().stats()
+        if index_stats['enabled']:
+            st.session_state.similarity_distance = st.slider(
+                "Similar-design threshold (bits)",
+                min_value=0, max_value=16,
+                value=st.session_state.similarity_distance,
+                help="Uploads whose perceptual hash differs by at most this many of 64 bits "
+                     "can reuse an earlier analysis"
+            )
+            st.caption(f"Indexed designs: {index_stats['entries']} · Reused: {index_stats['hits']}")
+        blob_stats = get_blob_store().stats()
+        st.caption(f"Spilled session data: {blob_stats['entries']} blobs ({blob_stats['bytes'] / 1024 / 1024:.1f} MB) · "
+                   f"this session holds {session_blobs().bytes / 1024:.0f} KB of "
+                   f"{session_blobs().max_bytes / 1024 / 1024:.0f} MB")
+        if st.button("🗑️ Clear Cache", use_container_width=True):
+            get_generation_cache().clear()
+            get_similarity_index().clear()
+            st.rerun()
+
+@st.cache_resource
+def get_generation_cache():
+    """One cache instance per server process so counters survive reruns"""
+    return GenerationCache()
+
+@st.cache_resource
+def get_blob_store():
+    """Spill store for session payloads, shared by every session in the process"""
+    return BlobStore()
+
+def session_blobs():
+    """This session's in-memory cache of resolved blobs, bounded by MOCKUP_SESSION_MEMORY_MB"""
+    if 'blob_cache' not in st.session_state:
+        st.session_state.blob_cache = SessionBlobCache(get_blob_store())
+    return st.session_state.blob_cache
+
+def design_file():
+    """The design being converted, read through the blob store"""
+    return get_blob_store().open(st.session_state.original_design)
+
+def placeholder_html():
+    """The analyzed HTML with image placeholders"""
+    return session_blobs().text(st.session_state.html_with_placeholders)
+
+def keep_session_blobs():
+    """Touch this session's blobs so garbage collection keeps them, then collect orphans
+
+    Returns False when blobs were already collected (e.g. after a long idle
+    period) and the session had to be reset.
+    """
+    refs = [st.session_state[key] for key in ('original_design', 'html_with_placeholders') if key in st.session_state]
+    refs.extend(st.session_state.get('uploaded_images', {}).values())
+    store = get_blob_store()
+    missing = store.touch(refs)
+    store.gc()
+    if not missing:
+        return True
+    for key in list(st.session_state.keys()):
+        del st.session_state[key]
+    initialize_session_state()
+    return False
+
+@st.cache_resource
+def get_similarity_index():
+    """Perceptual-hash index of analyzed designs, loaded once per server process"""
+    return SimilarityIndex()
+
+def find_similar_design(uploaded_file):
+    """Closest earlier design for this upload, looked up once per file and threshold"""
+    lookup_key = (uploaded_file.file_id, st.session_state.similarity_distance)
+    if st.session_state.get('similar_lookup_key') != lookup_key:
+        st.session_state.similar_lookup_key = lookup_key
+        st.session_state.similar_match = get_similarity_index().find(
+            uploaded_file, max_distance=st.session_state.similarity_distance
+        )
+    return st.session_state.similar_match
+
+def forget_similar_design():
+    """Drop the Step 1 match once the upload moves on"""
+    st.session_state.pop('similar_lookup_key', None)
+    st.session_state.pop('similar_match', None)
+
+def display_similar_design(uploaded_file, original_width, original_height):
+    """Offer the stored analysis of a near-identical design instead of calling the model"""
+    match = find_similar_design(uploaded_file)
+    if not match:
+        return
+    st.info(f"♻️ This looks like a design analyzed before ({match['width']}×{match['height']}px, "
+            f"{64 - match['distance']}/64 hash bits identical). Its HTML and image areas can be reused.")
+    if st.button("⚡ Reuse Previous Analysis", use_container_width=True):
+        # Only the entry's metadata is kept in session state; its HTML is read now
+        html = get_similarity_index().read_html(match['id'])
+        forget_similar_design()
+        if html is None:
+            st.warning("⚠️ That stored analysis was cleared. Please analyze the design instead.")
+            return
+        st.session_state.original_design = get_blob_store().put_file(uploaded_file)
+        st.session_state.original_width = original_width
+        st.session_state.original_height = original_height
+        st.session_state.html_with_placeholders = get_blob_store().put(html, 'index.html', 'text/html')
+        st.session_state.image_info = extract_image_info(html)
+        st.session_state.payload_report = f"♻️ Reused the analysis of a similar design (distance {match['distance']})"
+        st.session_state.analysis_done = True
+        st.session_state.step = 2
+        st.rerun()
+
+@st.cache_resource
+def get_model_cascade():
+    """Draft and refine generators for cascade mode, models from MOCKUP_DRAFT_MODEL / MOCKUP_REFINE_MODEL"""
+    return ModelCascade.from_env(cache=get_generation_cache())
+
+@st.cache_resource
+def get_html_generator():
+    """Shared generator so reruns don't reconfigure genai"""
+    return HTMLGenerator(cache=get_generation_cache(), backend=make_backend())
 
 def main():
     # Initialize session state
     initialize_session_state()
+    if not keep_session_blobs():
+        st.warning("⌛ This session's files expired and it was reset. Please upload your design again.")
+    display_cache_sidebar()
+    display_metrics_sidebar()
     
     # Header
     st.markdown('<h1 class="main-header">🎨 Smart HTML Converter</h1>', unsafe_allow_html=True)
@@ -159,6 +659,9 @@ def main():
         st.markdown(f'<div class="step-indicator {step4_class}">4. Final HTML</div>', unsafe_allow_html=True)
     
     st.markdown("---")
+    # Only mounted while a refinement is pending, so idle sessions don't keep polling
+    if 'refine_job_id' in st.session_state:
+        display_refinement_status()
     
     # Step 1: Upload Design
     if st.session_state.step == 1:
@@ -189,11 +692,13 @@ def main():
                 st.markdown('</div>', unsafe_allow_html=True)
             
             if st.button("🚀 Analyze Design (Original Size)", type="primary", use_container_width=True):
-                st.session_state.original_design = uploaded_file
+                st.session_state.original_design = get_blob_store().put_file(uploaded_file)
                 st.session_state.original_width = original_width
                 st.session_state.original_height = original_height
                 st.session_state.step = 2
+                forget_similar_design()
                 st.rerun()
+            display_similar_design(uploaded_file, original_width, original_height)
     
     # Step 2: AI Analysis
     elif st.session_state.step == 2:
@@ -209,35 +714,53 @@ def main():
         st.markdown('</div>', unsafe_allow_html=True)
         
         if not st.session_state.analysis_done:
-            with st.spinner(f"Analyzing your {original_width}×{original_height} pixel design..."):
-                try:
-                    generator = HTMLGenerator()
-                    image_b64 = generator.encode_image(st.session_state.original_design)
-                    html_with_placeholders = generator.generate_html_with_image_placeholders(
-                        image_b64, original_width, original_height
-                    )
-                    
-                    # Store results
-                    st.session_state.html_with_placeholders = html_with_placeholders
-                    st.session_state.image_info = extract_image_info(html_with_placeholders)
-                    st.session_state.analysis_done = True
-                    
-                except Exception as e:
-                    st.error(f"❌ Analysis failed: {str(e)}")
-                    if st.button("🔄 Try Again"):
-                        st.rerun()
+            st.markdown("#### ✍️ Live Preview")
+            try:
+                generator = get_html_generator()
+                job = current_analysis_job(generator, original_width, original_height)
+                if not job.done:
+                    # Only the progress fragment reruns while the worker keeps generating
+                    display_analysis_progress(original_width, original_height)
                     return
+                html_with_placeholders = job.wait()
+                st.session_state.payload_report = analysis_report(job)
+                del st.session_state.analysis_job_id
+                drafted = job.kind.startswith('draft')
+                
+                # Store results
+                st.session_state.html_with_placeholders = get_blob_store().put(
+                    html_with_placeholders, 'index.html', 'text/html'
+                )
+                st.session_state.image_info = extract_image_info(html_with_placeholders)
+                st.session_state.analysis_done = True
+                if drafted:
+                    get_similarity_index().add(design_file(), html_with_placeholders, get_model_cascade().draft.model_name)
+                    submit_refinement(html_with_placeholders)
+                else:
+                    get_similarity_index().add(design_file(), html_with_placeholders, generator.model_name)
+                
+            except Exception as e:
+                # Forget the failed job so "Try Again" submits a fresh one
+                st.session_state.pop('analysis_job_id', None)
+                st.error(f"❌ Analysis failed: {str(e)}")
+                if st.button("🔄 Try Again"):
+                    st.rerun()
+                return
         
         # Show analysis results
         if st.session_state.analysis_done:
             st.success(f"✅ Analysis complete! Found {len(st.session_state.image_info)} image areas")
+            if 'payload_report' in st.session_state:
+                st.caption(st.session_state.payload_report)
             
             # Show preview
             st.markdown("#### 📐 Design with Detected Image Areas")
-            preview_html, preview_height = create_full_preview_html(st.session_state.html_with_placeholders, original_width, original_height)
+            with timed("preview"):
+                preview_html, preview_height = cached_preview_html(output_html()[0], original_width, original_height)
             st.components.v1.html(preview_html, height=preview_height, scrolling=False)
             st.info("🔄 Dashed areas show where images were detected")
-            
+            display_revision_section()
+
             if st.button("📸 Continue to Image Replacement", type="primary", use_container_width=True):
                 st.session_state.step = 3
                 st.rerun()
@@ -257,10 +780,11 @@ def main():
         col1, col2 = st.columns(2)
         with col1:
             st.markdown("#### Original Design")
-            st.image(st.session_state.original_design, use_container_width=True)
+            st.image(get_blob_store().read_bytes(st.session_state.original_design), use_container_width=True)
         with col2:
             st.markdown("#### With Image Placeholders")
-            preview_html, preview_height = create_full_preview_html(st.session_state.html_with_placeholders, st.session_state.original_width, st.session_state.original_height)
+            with timed("preview"):
+                preview_html, preview_height = cached_preview_html(output_html()[0], st.session_state.original_width, st.session_state.original_height)
             st.components.v1.html(preview_html, height=preview_height, scrolling=False)
         
         # Image upload
@@ -279,7 +803,11 @@ def main():
         with col2:
             if all_uploaded:
                 if st.button("🚀 Generate Final HTML →", type="primary", use_container_width=True):
-                    st.session_state.uploaded_images = uploaded_images
+                    # Only handles stay in the session; the widgets' files are released with Step 3
+                    st.session_state.uploaded_images = {
+                        img_id: get_blob_store().put_file(uploaded_file)
+                        for img_id, uploaded_file in uploaded_images.items()
+                    }
                     st.session_state.step = 4
                     st.rerun()
             else:
@@ -302,13 +830,26 @@ def main():
         
         with st.spinner("Generating final HTML with your images..."):
             try:
-                generator = HTMLGenerator()
-                final_html = generator.replace_image_placeholders(
-                    st.session_state.html_with_placeholders,
-                    st.session_state.uploaded_images
-                )
+                with timed("replace"):
+                    html_ref, optimize_report = output_html()
+                    final_ref, issues = cached_blobs(
+                        cached_final_html,
+                        html_ref,
+                        st.session_state.uploaded_images,
+                        st.session_state.image_info
+                    )
                 
                 st.success("🎉 Your website is ready!")
+                for issue in issues:
+                    st.warning(f"⚠️ {issue}")
+                if optimize_report and not optimize_report.get('skipped'):
+                    st.caption(f"🪶 Optimized HTML: {optimize_report['input_bytes'] / 1024:.1f} KB → "
+                               f"{optimize_report['output_bytes'] / 1024:.1f} KB "
+                               f"(-{optimize_report['reduction']:.0%}) · "
+                               f"{optimize_report['styles_replaced']} inline styles → "
+                               f"{optimize_report['style_classes']} classes · critical CSS "
+                               f"{optimize_report['critical_css_bytes'] / 1024:.1f} KB inline, "
+                               f"{optimize_report['deferred_css_bytes'] / 1024:.1f} KB deferred")
                 
                 # Show final result comparison - FULL PREVIEW WITHOUT SCROLLING
                 st.markdown("### 🔍 Side-by-Side Comparison")
@@ -319,37 +860,84 @@ def main():
                 col1, col2 = st.columns(2)
                 with col1:
                     st.markdown(f"#### Original Design")
-                    st.image(st.session_state.original_design, use_container_width=True)
+                    st.image(get_blob_store().read_bytes(st.session_state.original_design), use_container_width=True)
                     st.caption(f"Original: {st.session_state.original_width}×{st.session_state.original_height}px")
                 
                 with col2:
                     st.markdown("#### Final HTML Result")
                     # Create full preview without internal scrolling
-                    full_preview_html = f"""
-                    <div style="width: 100%; height: {display_height}px; overflow: visible; border: 1px solid #ddd; border-radius: 10px; padding: 10px; background: white;">
-                        <div style="transform: scale(0.7); transform-origin: top left; width: 142.857%;">
-                            {final_html}
-                        </div>
-                    </div>
-                    """
-                    st.components.v1.html(full_preview_html, height=display_height, scrolling=False)
+                    with timed("preview"):
+                        preview_ref = cached_blobs(cached_final_preview_html, final_ref, display_height)
+                    st.components.v1.html(get_blob_store().read_text(preview_ref), height=display_height, scrolling=False)
                     st.caption("Fully rendered HTML - No scrolling needed")
                 
                 # Code and download
                 st.markdown("---")
+                export_mode = st.radio(
+                    "Export format",
+                    ["Single HTML file", "Zip bundle (index.html + image files)"],
+                    horizontal=True,
+                    help="The bundle keeps images as separate, cacheable files instead of inline base64"
+                )
+                bundle_mode = export_mode.startswith("Zip")
+                if bundle_mode:
+                    with timed("bundle"):
+                        index_html, assets, _, bundle_stats = cached_blobs(
+                            cached_asset_bundle,
+                            html_ref,
+                            st.session_state.uploaded_images,
+                            st.session_state.image_info
+                        )
+                    st.caption(f"📦 index.html {bundle_stats['index_bytes'] / 1024:.0f} KB + "
+                               f"{bundle_stats['assets']} image files ({bundle_stats['asset_bytes'] / 1024:.0f} KB, "
+                               f"{bundle_stats['deduplicated']} duplicates stored once) · "
+                               f"single file: {final_ref.size / 1024:.0f} KB")
+                
                 st.markdown("#### 📝 HTML Code")
-                with st.expander("View/Edit HTML Code", expanded=True):
-                    edited_code = st.text_area("HTML Code:", value=final_html, height=300, key="final_code")
+                # The text area keeps its own copy in the session, so very large
+                # single-file HTML is only loaded into it on request
+                editable = bundle_mode or final_ref.size <= INLINE_EDIT_BYTES or st.checkbox(
+                    f"Edit the {final_ref.size / 1024 / 1024:.1f} MB HTML in the browser",
+                    key="edit_large_html"
+                )
+                edited_code = None
+                if editable:
+                    with st.expander("View/Edit HTML Code", expanded=True):
+                        edited_code = st.text_area(
+                            "HTML Code:",
+                            value=index_html if bundle_mode else get_blob_store().read_text(final_ref),
+                            height=300,
+                            key="final_bundle_code" if bundle_mode else "final_code"
+                        )
+                else:
+                    st.caption("The download below serves the generated file as is.")
                 
                 # Download button
-                st.download_button(
-                    "💾 Download HTML File",
-                    edited_code,
-                    file_name="website.html",
-                    mime="text/html",
-                    use_container_width=True
-                )
+                if bundle_mode:
+                    with timed("bundle_zip"):
+                        archive_ref = cached_blobs(cached_bundle_archive, edited_code, assets)
+                    # st.download_button needs the bytes in hand; the archive itself
+                    # is built once per edit, streaming one asset at a time
+                    st.download_button(
+                        "💾 Download Website Bundle (.zip)",
+                        get_blob_store().read_bytes(archive_ref),
+                        file_name="website.zip",
+                        mime="application/zip",
+                        use_container_width=True
+                    )
+                else:
+                    st.download_button(
+                        "💾 Download HTML File",
+                        edited_code if edited_code is not None else get_blob_store().read_bytes(final_ref),
+                        file_name="website.html",
+                        mime="text/html",
+                        use_container_width=True
+                    )
                 
+                display_revision_section()
+                if 'payload_report' in st.session_state:
+                    st.caption(st.session_state.payload_report)
+
                 # Start over
                 if st.button("🔄 Start New Project", type="primary", use_container_width=True):
                     for key in list(st.session_state.keys()):
@@ -362,5 +950,20 @@ def main():
                     st.session_state.step = 3
                     st.rerun()
 
+def run():
+    """Run one script pass and report how long it took"""
+    started = time.perf_counter()
+    st.session_state.rerun_count = st.session_state.get('rerun_count', 0) + 1
+    st.session_state.stage_timings = {}
+    metrics.incr('reruns', step=st.session_state.get('step', 1))
+    start_metrics_endpoint()
+    timing_slot = st.sidebar.empty()
+    try:
+        main()
+    finally:
+        # st.rerun() unwinds through here too, so the readout covers every pass
+        display_rerun_timing(timing_slot, started)
+        metrics.export_metrics_file()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run()
\ No newline at end of file
@@ -0,0 +1,226 @@
+# backends.py
+"""Model backends for HTMLGenerator: Gemini, and an offline stub for tests and benchmarks"""
+import hashlib
+import os
+import re
+import time
+
+import metrics
+from client import get_model
+
+# USD per million (input, output) tokens, for the cost counters
+MODEL_PRICES = {
+    'gemini-2.5-pro': (1.25, 10.00),
+    'gemini-2.5-flash': (0.30, 2.50),
+    'gemini-2.5-flash-lite': (0.10, 0.40)
+}
+
+
+class ModelBackend:
+    """Interface: generate() returns the full text, stream() yields chunks"""
+
+    model_name = None
+    # Cascade stage ('draft', 'refine') used to label token and cost counters
+    tier = None
+
+    def generate(self, prompt, image_b64, mime_type):
+        raise NotImplementedError
+
+    def stream(self, prompt, image_b64, mime_type):
+        yield self.generate(prompt, image_b64, mime_type)
+
+
+class GeminiBackend(ModelBackend):
+    """Google Gemini through the shared process-wide client"""
+
+    def __init__(self, model_name='gemini-2.5-pro', tier=None):
+        self.model_name = model_name
+        self.tier = tier
+
+    @property
+    def model(self):
+        return get_model(self.model_name)
+
+    def generate(self, prompt, image_b64, mime_type):
+        with metrics.span('model_call', model=self.model_name) as span:
+            response = self.model.generate_content([
+                prompt,
+                {"mime_type": mime_type, "data": image_b64}
+            ])
+            record_usage(span, self.model_name, response, self.tier)
+            return response.text
+
+    def stream(self, prompt, image_b64, mime_type):
+        with metrics.span('model_call', model=self.model_name, stream=True) as span:
+            response = self.model.generate_content([
+                prompt,
+                {"mime_type": mime_type, "data": image_b64}
+            ], stream=True)
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. safety/finish metadata)
+                    continue
+                yield text
+            # Usage metadata is complete once the stream is exhausted
+            record_usage(span, self.model_name, response, self.tier)
+
+
+def record_usage(span, model_name, response, tier=None):
+    """Copy Gemini token usage and its estimated cost onto the span and the counters"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return
+    tokens = {
+        'prompt': getattr(usage, 'prompt_token_count', 0) or 0,
+        'output': getattr(usage, 'candidates_token_count', 0) or 0,
+        'total': getattr(usage, 'total_token_count', 0) or 0
+    }
+    span.set(**{f'{kind}_tokens': count for kind, count in tokens.items()})
+    labels = {'model': model_name, 'tier': tier} if tier else {'model': model_name}
+    for kind, count in tokens.items():
+        metrics.incr('tokens', count, kind=kind, **labels)
+    prices = MODEL_PRICES.get(model_name)
+    if prices:
+        cost = (tokens['prompt'] * prices[0] + tokens['output'] * prices[1]) / 1_000_000
+        span.set(cost_usd=round(cost, 6))
+        metrics.incr('cost_usd', cost, **labels)
+
+
+def image_digest(image_b64):
+    """Short content hash used to name recordings"""
+    if isinstance(image_b64, str):
+        image_b64 = image_b64.encode('utf-8')
+    return hashlib.sha256(image_b64).hexdigest()[:16]
+
+
+class StubBackend(ModelBackend):
+    """Deterministic offline backend
+
+    Replays <recordings_dir>/<image digest>.html when present, otherwise
+    synthesizes a page with `images` placeholders. `latency` is paid once per
+    call (time to first chunk) and `chunk_latency` per streamed chunk.
+    """
+
+    def __init__(self, model_name='stub', recordings_dir=None, latency=0.0, chunk_latency=0.0,
+                 chunk_size=512, images=3, tier=None):
+        self.model_name = model_name
+        self.tier = tier
+        self.recordings_dir = recordings_dir
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.chunk_size = chunk_size
+        self.images = images
+        self.calls = 0
+
+    def _text(self, prompt, image_b64):
+        self.calls += 1
+        if self.recordings_dir:
+            path = os.path.join(self.recordings_dir, f"{image_digest(image_b64)}.html")
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    return f.read()
+        return synthetic_html(prompt, image_digest(image_b64), self.images)
+
+    def generate(self, prompt, image_b64, mime_type):
+        text = self._text(prompt, image_b64)
+        chunks = -(-len(text) // self.chunk_size)
+        time.sleep(self.latency + self.chunk_latency * chunks)
+        return text
+
+    def stream(self, prompt, image_b64, mime_type):
+        text = self._text(prompt, image_b64)
+        time.sleep(self.latency)
+        for start in range(0, len(text), self.chunk_size):
+            if self.chunk_latency:
+                time.sleep(self.chunk_latency)
+            yield text[start:start + self.chunk_size]
+
+
+class RecordingBackend(ModelBackend):
+    """Wrap another backend and save each response for later StubBackend replay"""
+
+    def __init__(self, backend, recordings_dir):
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.recordings_dir = recordings_dir
+        os.makedirs(recordings_dir, exist_ok=True)
+
+    def _save(self, image_b64, text):
+        with open(os.path.join(self.recordings_dir, f"{image_digest(image_b64)}.html"), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def generate(self, prompt, image_b64, mime_type):
+        text = self.backend.generate(prompt, image_b64, mime_type)
+        self._save(image_b64, text)
+        return text
+
+    def stream(self, prompt, image_b64, mime_type):
+        chunks = []
+        for chunk in self.backend.stream(prompt, image_b64, mime_type):
+            chunks.append(chunk)
+            yield chunk
+        self._save(image_b64, ''.join(chunks))
+
+
+def synthetic_html(prompt, seed, images=3):
+    """A plausible generated page in the format the real prompt asks for"""
+    size = re.search(r'(\d+)x(\d+) pixel', prompt) or re.search(r'(\d+)x(\d+)', prompt)
+    width, height = (int(size.group(1)), int(size.group(2))) if size else (1200, 800)
+    slot_width = max(120, width // 3)
+    slot_height = max(80, slot_width * 2 // 3)
+
+    parts = [f"<!-- TOTAL_IMAGES:{images} -->"]
+    for img_id in range(1, images + 1):
+        parts.append(f"<!-- IMAGE_{img_id}: width={slot_width} height={slot_height} synthetic image {img_id} -->")
+    parts.append(f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Design {seed}</title>
+<style>
+    body {{ margin: 0; font-family: Arial, sans-serif; color: #222; }}
+    .page {{ max-width: {width}px; margin: 0 auto; }}
+    .image-placeholder {{ border: 2px dashed #999; background: #f4f4f4; display: flex; align-items: center; justify-content: center; }}
+</style>
+</head>
+<body>
+<div class="page">
+    <header style="display: flex; justify-content: space-between; padding: 24px 40px; background: #ffffff;">
+        <div style="font-size: 24px; font-weight: bold; color: #1a1a1a;">Brand {seed[:4]}</div>
+        <nav style="display: flex; gap: 24px; font-size: 16px; color: #444444;">
+            <a style="color: #444444; text-decoration: none;">Home</a>
+            <a style="color: #444444; text-decoration: none;">About</a>
+            <a style="color: #444444; text-decoration: none;">Contact</a>
+        </nav>
+    </header>""")
+    for img_id in range(1, images + 1):
+        parts.append(f"""    <section style="display: flex; gap: 32px; padding: 48px 40px; align-items: center;">
+        <div style="flex: 1;">
+            <h2 style="font-size: 32px; margin: 0 0 16px 0; color: #1a1a1a;">Section {img_id}</h2>
+            <p style="font-size: 16px; line-height: 1.6; color: #555555;">Synthetic content for benchmarking the conversion pipeline.</p>
+        </div>
+        <!-- IMAGE_START_{img_id} --><div class="image-placeholder" style="width: {slot_width}px; height: {slot_height}px;">Image {img_id}</div><!-- IMAGE_END_{img_id} -->
+    </section>""")
+    parts.append("""    <footer style="padding: 24px 40px; background: #1a1a1a; color: #ffffff; font-size: 14px;">© Synthetic</footer>
+</div>
+</body>
+</html>""")
+    return '\n'.join(parts)
+
+
+def make_backend(name=None, model_name=None, tier=None):
+    """Backend from a name ('gemini' or 'stub'), defaulting to $MOCKUP_BACKEND"""
+    name = name or os.environ.get("MOCKUP_BACKEND", "gemini")
+    if name == 'stub':
+        return StubBackend(
+            # Distinct names per tier so draft and refine don't share cache entries
+            model_name=f"stub-{tier}" if tier else 'stub',
+            recordings_dir=os.environ.get("MOCKUP_STUB_RECORDINGS"),
+            latency=float(os.environ.get("MOCKUP_STUB_LATENCY", "0")),
+            tier=tier
+        )
+    if name == 'gemini':
+        return GeminiBackend(model_name or 'gemini-2.5-pro', tier)
+    raise ValueError(f"Unknown backend: {name}")
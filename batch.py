@@ -0,0 +1,369 @@
+# batch.py
+"""Headless batch conversion of mockup directories"""
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+from main import HTMLGenerator, extract_image_info, get_image_dimensions
+from backends import make_backend
+from images import ImageFile
+from export import build_asset_bundle, write_asset_bundle
+from optimize import optimize_html
+from project import STYLESHEET_NAME, Project
+from tiling import is_tall
+
+MOCKUP_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+REPLACEMENT_PATTERN = re.compile(r'^image-(\d+)-(\d+)\.(?:jpe?g|png|webp|gif)$', re.IGNORECASE)
+# Anything named like a replacement (including "image-3-2 (2).png" copies) is never a mockup
+REPLACEMENT_PREFIX = re.compile(r'^image-\d+-\d+', re.IGNORECASE)
+
+
+class RateLimiter:
+    """Thread-safe limiter spacing calls evenly at a maximum rate per minute"""
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def with_retries(func, retries, backoff, limiter):
+    """Call func under the rate limiter, retrying with exponential backoff and jitter"""
+    attempt = 0
+    while True:
+        limiter.wait()
+        try:
+            return func()
+        except Exception:
+            if attempt >= retries:
+                raise
+            time.sleep(backoff * (2 ** attempt) * (0.5 + random.random()))
+            attempt += 1
+
+
+def collect_mockups(inputs):
+    """Expand directories and globs into an ordered list of mockup paths"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = [os.path.join(item, name) for name in os.listdir(item)]
+        else:
+            candidates = glob.glob(item)
+        for path in candidates:
+            name = os.path.basename(path)
+            if (os.path.isfile(path) and name.lower().endswith(MOCKUP_EXTENSIONS)
+                    and not REPLACEMENT_PREFIX.match(name)):
+                paths.append(path)
+    return sorted(set(paths), key=_natural_key)
+
+
+def _natural_key(path):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+
+def page_number(path, mockups_in_dir):
+    """Page number from a numeric file stem, else position within its directory"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if stem.isdigit():
+        return int(stem)
+    return mockups_in_dir.index(path) + 1
+
+
+def find_replacements(directory, page):
+    """Map slot id -> replacement image path for one page: image-3-2.png fills slot 2 of page 3"""
+    replacements = {}
+    for name in os.listdir(directory):
+        match = REPLACEMENT_PATTERN.match(name)
+        if match and int(match.group(1)) == page:
+            replacements[int(match.group(2))] = os.path.join(directory, name)
+    return replacements
+
+
+def output_path(mockup_path, output_dir, mockups):
+    """Output file for a mockup, in a per-directory subfolder when inputs span several directories"""
+    stem = os.path.splitext(os.path.basename(mockup_path))[0]
+    directories = {os.path.dirname(os.path.abspath(p)) for p in mockups}
+    if len(directories) > 1:
+        output_dir = os.path.join(output_dir, os.path.basename(os.path.dirname(os.path.abspath(mockup_path))))
+    return os.path.join(output_dir, f"{stem}.html")
+
+
+def convert_one(generator, mockup_path, page, target, args, limiter):
+    """Run one mockup through analysis and image replacement"""
+    timings = {'file': mockup_path, 'output': target}
+    start = time.perf_counter()
+
+    design = ImageFile.from_path(mockup_path)
+    width, height = get_image_dimensions(design)
+    tiled = args.tiled and is_tall(width, height)
+    # Tiled pages encode each band as it is generated, never the whole image
+    payload = None if tiled else generator.prepare_image(design)
+    timings['encode'] = time.perf_counter() - start
+
+    step = time.perf_counter()
+    if tiled:
+        # Every band is a model call, so each takes its own limiter slot and retries on its own
+        html = generator.generate_html_tiled(
+            design, width, height, use_cache=not args.no_cache,
+            band_runner=lambda call: with_retries(call, args.retries, args.backoff, limiter)
+        )
+    else:
+        html = with_retries(
+            lambda: generator.generate_html_with_image_placeholders(
+                payload['data'], width, height,
+                use_cache=not args.no_cache,
+                mime_type=payload['mime_type']
+            ),
+            args.retries, args.backoff, limiter
+        )
+    timings['generate'] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    timings['output'], timings['images'], timings['optimize'] = write_page(
+        generator, html, mockup_path, page, target, args
+    )
+    timings['replace'] = time.perf_counter() - step
+    timings['total'] = time.perf_counter() - start
+    return timings
+
+
+def write_page(generator, html, mockup_path, page, target, args, image_info=None):
+    """Optimize the page, fill its placeholders with its replacement images and write it
+
+    Returns (output path, "replaced/total" images, optimize_html report or None).
+    """
+    if image_info is None:
+        image_info = extract_image_info(html)
+    report = None
+    if not args.no_optimize:
+        html, report = optimize_html(html)
+    available = find_replacements(os.path.dirname(mockup_path) or '.', page)
+    replacements = {
+        img_id: ImageFile.from_path(available[img_id])
+        for img_id in image_info if img_id in available
+    }
+    issues = []
+    if args.bundle:
+        index_html, assets, issues, _ = build_asset_bundle(html, replacements, image_info=image_info)
+    else:
+        final_html = generator.replace_image_placeholders(html, replacements, issues=issues, image_info=image_info)
+    for issue in issues:
+        print(f"! {mockup_path}: {issue}", file=sys.stderr)
+
+    if args.bundle:
+        target = os.path.splitext(target)[0] + '.zip'
+        with open(target, 'wb') as f:
+            write_asset_bundle(index_html, assets, f)
+    else:
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(final_html)
+    return target, f"{len(replacements)}/{len(image_info)}", report
+
+
+def convert_projects(generator, mockups, args, limiter):
+    """Project mode: every input directory is one project with a shared stylesheet
+
+    Each project's first page is generated first; once it lands, the rest of
+    that project is queued with its design system as context. The pages are
+    then assembled together and styles.css is written next to them.
+    Returns (results, failures, summaries).
+    """
+    groups = OrderedDict()
+    for path in mockups:
+        groups.setdefault(os.path.dirname(path), []).append(path)
+    projects = {directory: Project(generator) for directory in groups}
+    generated = {}
+    failures = []
+
+    def generate(directory, path):
+        start = time.perf_counter()
+        design = ImageFile.from_path(path)
+        width, height = get_image_dimensions(design)
+        payload = generator.prepare_image(design)
+        encoded = time.perf_counter()
+        html = with_retries(
+            lambda: projects[directory].generate_page(payload, width, height, use_cache=not args.no_cache),
+            args.retries, args.backoff, limiter
+        )
+        return html, encoded - start, time.perf_counter() - encoded
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        first_pages = {pool.submit(generate, directory, paths[0]): directory for directory, paths in groups.items()}
+        other_pages = {}
+        for future in as_completed(first_pages):
+            directory = first_pages[future]
+            path = groups[directory][0]
+            try:
+                generated[path] = future.result()
+                projects[directory].establish(generated[path][0])
+            except Exception as e:
+                failures.append((path, str(e)))
+                failures.extend((other, "skipped: first page of the project failed") for other in groups[directory][1:])
+                print(f"✗ {path}: {e}", file=sys.stderr)
+                continue
+            for other in groups[directory][1:]:
+                other_pages[pool.submit(generate, directory, other)] = other
+
+        for future in as_completed(other_pages):
+            path = other_pages[future]
+            try:
+                generated[path] = future.result()
+            except Exception as e:
+                failures.append((path, str(e)))
+                print(f"✗ {path}: {e}", file=sys.stderr)
+
+    results = []
+    summaries = []
+    for directory, paths in groups.items():
+        project = projects[directory]
+        summary = {'project': directory or '.', 'pages': 0, 'response_bytes': 0, 'page_bytes': 0,
+                   'components': 0}
+        target = None
+        done = [path for path in paths if path in generated]
+        assembled = project.assemble_pages([generated[path][0] for path in done])
+        for path, (page_html, image_info, stats) in zip(done, assembled):
+            _, encode_seconds, generate_seconds = generated[path]
+            step = time.perf_counter()
+            target = output_path(path, args.output_dir, mockups)
+            os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+            output, images, report = write_page(generator, page_html, path, page_number(path, paths), target, args,
+                                                image_info=image_info)
+            replace_seconds = time.perf_counter() - step
+            results.append({
+                'file': path, 'output': output, 'images': images, 'optimize': report, 'encode': encode_seconds,
+                'generate': generate_seconds, 'replace': replace_seconds,
+                'total': encode_seconds + generate_seconds + replace_seconds
+            })
+            summary['pages'] += 1
+            summary['response_bytes'] += stats['response_bytes']
+            summary['page_bytes'] += stats['page_bytes']
+            summary['components'] += len(stats['components'])
+            print(f"✓ {path} → {output} ({results[-1]['total']:.2f}s)", file=sys.stderr)
+        if target is None:
+            continue
+        stylesheet = project.stylesheet.text()
+        with open(os.path.join(os.path.dirname(target) or '.', STYLESHEET_NAME), 'w', encoding='utf-8') as f:
+            f.write(stylesheet + '\n')
+        summary['stylesheet_bytes'] = len(stylesheet.encode('utf-8')) + 1
+        summaries.append(summary)
+    return results, failures, summaries
+
+
+def print_project_summary(summaries):
+    """Shared stylesheet and page sizes against the raw model output, per project"""
+    for summary in summaries:
+        total = summary['stylesheet_bytes'] + summary['page_bytes']
+        saved = 1 - total / summary['response_bytes'] if summary['response_bytes'] else 0.0
+        print(f"{summary['project']}: {summary['pages']} pages + {STYLESHEET_NAME} = {total / 1024:.1f} KB "
+              f"({summary['stylesheet_bytes'] / 1024:.1f} KB shared CSS; model output "
+              f"{summary['response_bytes'] / 1024:.1f} KB, {saved:.0%} smaller), "
+              f"{summary['components']} shared components reused")
+
+
+def print_summary(results, failures, wall_time):
+    """Print a per-file timing table"""
+    header = f"{'file':<40} {'encode':>8} {'generate':>9} {'replace':>8} {'total':>8} {'images':>7}"
+    print(header)
+    print('-' * len(header))
+    for row in results:
+        print(f"{row['file']:<40} {row['encode']:>7.2f}s {row['generate']:>8.2f}s "
+              f"{row['replace']:>7.2f}s {row['total']:>7.2f}s {row['images']:>7}")
+    for path, error in failures:
+        print(f"{path:<40} FAILED: {error}")
+    reports = [row['optimize'] for row in results if row.get('optimize')]
+    if reports:
+        before = sum(report['input_bytes'] for report in reports)
+        after = sum(report['output_bytes'] for report in reports)
+        print(f"\nOptimized HTML: {before / 1024:.1f} KB → {after / 1024:.1f} KB "
+              f"(-{1 - after / before if before else 0:.0%}) before images were inlined")
+    print(f"\n{len(results)} converted, {len(failures)} failed in {wall_time:.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a directory of mockups to HTML without the UI")
+    parser.add_argument('inputs', nargs='+', help="Mockup directories, files or glob patterns")
+    parser.add_argument('-o', '--output-dir', default='output', help="Where to write the HTML files")
+    parser.add_argument('--workers', type=int, default=4, help="Concurrent generations")
+    parser.add_argument('--rpm', type=float, default=30, help="Maximum model requests per minute (0 = unlimited)")
+    parser.add_argument('--retries', type=int, default=3, help="Retries per file on model errors")
+    parser.add_argument('--backoff', type=float, default=2.0, help="Initial retry backoff in seconds")
+    parser.add_argument('--model', default='gemini-2.5-pro', help="Gemini model name")
+    parser.add_argument('--backend', choices=['gemini', 'stub'], default=None,
+                        help="Model backend (default: $MOCKUP_BACKEND or gemini)")
+    parser.add_argument('--no-cache', action='store_true', help="Bypass the generation cache")
+    parser.add_argument('--tiled', action='store_true',
+                        help="Analyze very tall mockups as parallel overlapping bands")
+    parser.add_argument('--metrics-file', help="Write Prometheus-format stage metrics here when done "
+                                               "(per-span traces go to $MOCKUP_TRACE_FILE)")
+    parser.add_argument('--bundle', action='store_true',
+                        help="Write a zip of index.html plus content-hashed image files instead of inline images")
+    parser.add_argument('--no-optimize', action='store_true',
+                        help="Skip the style dedup / minify / critical-CSS pass on the generated HTML")
+    parser.add_argument('--project', action='store_true',
+                        help="Treat each input directory as one multi-page project with a shared styles.css")
+    args = parser.parse_args(argv)
+    if args.project and (args.bundle or args.tiled):
+        parser.error("--project cannot be combined with --bundle or --tiled")
+
+    mockups = collect_mockups(args.inputs)
+    if not mockups:
+        parser.error("no mockups found")
+
+    generator = HTMLGenerator(backend=make_backend(args.backend, args.model))
+    limiter = RateLimiter(args.rpm)
+
+    started = time.perf_counter()
+    if args.project:
+        results, failures, summaries = convert_projects(generator, mockups, args, limiter)
+        results.sort(key=lambda row: _natural_key(row['file']))
+        print_summary(results, failures, time.perf_counter() - started)
+        print_project_summary(summaries)
+        metrics.export_metrics_file(args.metrics_file)
+        return 1 if failures else 0
+
+    results = []
+    failures = []
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {}
+        for path in mockups:
+            siblings = [p for p in mockups if os.path.dirname(p) == os.path.dirname(path)]
+            page = page_number(path, siblings)
+            target = output_path(path, args.output_dir, mockups)
+            os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+            futures[pool.submit(convert_one, generator, path, page, target, args, limiter)] = path
+
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                row = future.result()
+                results.append(row)
+                print(f"✓ {path} → {row['output']} ({row['total']:.2f}s)", file=sys.stderr)
+            except Exception as e:
+                failures.append((path, str(e)))
+                print(f"✗ {path}: {e}", file=sys.stderr)
+
+    results.sort(key=lambda row: _natural_key(row['file']))
+    print_summary(results, failures, time.perf_counter() - started)
+    metrics.export_metrics_file(args.metrics_file)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
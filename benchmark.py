@@ -0,0 +1,149 @@
+# benchmark.py
+"""Offline per-stage benchmark of the pipeline over the Design/ corpus"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from main import HTMLGenerator, create_full_preview_html, extract_image_info, get_image_dimensions
+from backends import StubBackend
+from batch import collect_mockups, find_replacements, page_number
+from images import ImageFile
+
+DEFAULT_CORPUS = ['Design/Proposal', 'Design/event']
+
+
+def output_size(value):
+    """Size in bytes of a stage result"""
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, dict) and 'data' in value:
+        return len(value['data'])
+    if isinstance(value, tuple):
+        return output_size(value[0])
+    if isinstance(value, dict):
+        return len(json.dumps(value))
+    return 0
+
+
+def measure(func, repeat):
+    """Median latency over `repeat` runs, then peak memory from one traced run"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, {
+        'latency_ms': statistics.median(timings) * 1000,
+        'peak_kb': peak / 1024,
+        'output_bytes': output_size(result)
+    }
+
+
+def bench_mockup(path, page, repeat, latency):
+    """Run one mockup through every stage"""
+    design = ImageFile.from_path(path)
+    width, height = get_image_dimensions(design)
+    replacement_paths = find_replacements(os.path.dirname(path), page)
+    replacements = {img_id: ImageFile.from_path(p) for img_id, p in replacement_paths.items()}
+
+    # Synthesize as many slots as the page has replacement images for
+    backend = StubBackend(latency=latency, images=max(replacements, default=3))
+    generator = HTMLGenerator(cache=False, backend=backend)
+    stages = {}
+
+    _, stages['encode_image'] = measure(lambda: generator.encode_image(design), repeat)
+    payload, stages['prepare_image'] = measure(lambda: generator.prepare_image(design), repeat)
+    html, stages['generate'] = measure(
+        lambda: generator.generate_html_with_image_placeholders(
+            payload['data'], width, height, use_cache=False, mime_type=payload['mime_type']
+        ),
+        repeat
+    )
+    image_info, stages['extract_image_info'] = measure(lambda: extract_image_info(html), repeat)
+    final_html, stages['replace_image_placeholders'] = measure(
+        lambda: generator.replace_image_placeholders(html, replacements, image_info=image_info), repeat
+    )
+    _, stages['create_full_preview_html'] = measure(
+        lambda: create_full_preview_html(final_html, width, height), repeat
+    )
+    return {'file': path, 'size': f"{width}x{height}", 'images': len(replacements), 'stages': stages}
+
+
+def print_report(results):
+    """Per-file, per-stage table followed by stage totals"""
+    print(f"{'file':<28} {'stage':<28} {'latency':>11} {'peak mem':>11} {'output':>11}")
+    print('-' * 93)
+    totals = {}
+    for row in results:
+        for stage, metrics in row['stages'].items():
+            print(f"{row['file']:<28} {stage:<28} {metrics['latency_ms']:>9.2f}ms "
+                  f"{metrics['peak_kb']:>9.0f}KB {metrics['output_bytes'] / 1024:>9.1f}KB")
+            totals[stage] = totals.get(stage, 0.0) + metrics['latency_ms']
+    print('-' * 93)
+    for stage, total in totals.items():
+        print(f"{'TOTAL':<28} {stage:<28} {total:>9.2f}ms")
+
+
+def compare(results, baseline, tolerance):
+    """List stages whose latency or output size grew beyond tolerance"""
+    previous = {row['file']: row['stages'] for row in baseline}
+    regressions = []
+    for row in results:
+        for stage, metrics in row['stages'].items():
+            old = previous.get(row['file'], {}).get(stage)
+            if not old:
+                continue
+            for metric in ('latency_ms', 'output_bytes'):
+                # Ignore sub-millisecond noise on fast stages
+                floor = 1.0 if metric == 'latency_ms' else 0
+                if metrics[metric] > max(old[metric] * (1 + tolerance), old[metric] + floor):
+                    regressions.append(f"{row['file']} {stage} {metric}: {old[metric]:.1f} -> {metrics[metric]:.1f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the mockup-to-HTML pipeline offline")
+    parser.add_argument('inputs', nargs='*', default=DEFAULT_CORPUS, help="Mockup directories or globs")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per stage (median is reported)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated model latency in seconds")
+    parser.add_argument('--json', help="Write results to this file")
+    parser.add_argument('--baseline', help="Compare against a previous --json file")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative regression")
+    args = parser.parse_args(argv)
+
+    mockups = collect_mockups(args.inputs)
+    if not mockups:
+        parser.error("no mockups found")
+
+    results = []
+    for path in mockups:
+        siblings = [p for p in mockups if os.path.dirname(p) == os.path.dirname(path)]
+        results.append(bench_mockup(path, page_number(path, siblings), args.repeat, args.latency))
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+# blobs.py
+"""Content-addressed on-disk store for large session payloads"""
+import hashlib
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from cache import atomic_write, temp_path
+from images import ImageFile, read_image_bytes
+
+DEFAULT_BLOB_DIR = os.environ.get("MOCKUP_BLOB_DIR", os.path.join(".cache", "blobs"))
+DEFAULT_MAX_AGE = int(os.environ.get("MOCKUP_BLOB_TTL", 6 * 60 * 60))
+# Resolved blobs a session may keep in memory between reruns
+DEFAULT_SESSION_MEMORY = int(float(os.environ.get("MOCKUP_SESSION_MEMORY_MB", "16")) * 1024 * 1024)
+GC_INTERVAL = 10 * 60
+
+BlobRef = namedtuple('BlobRef', ['digest', 'size', 'name', 'mime_type'])
+
+
+class MappedFile:
+    """Read-only file object over a memory-mapped blob, with UploadedFile's name/type"""
+
+    def __init__(self, path, name, mime_type):
+        self.name = name
+        self.type = mime_type
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, size=-1):
+        return self._map.read(size if size is not None and size >= 0 else None)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._map.seek(offset, whence)
+        return self._map.tell()
+
+    def tell(self):
+        return self._map.tell()
+
+    def getvalue(self):
+        return self._map[:]
+
+    def close(self):
+        self._map.close()
+
+
+class BlobStore:
+    """Blobs on local disk keyed by content hash, with age-based garbage collection"""
+
+    def __init__(self, blob_dir=DEFAULT_BLOB_DIR, max_age=DEFAULT_MAX_AGE):
+        self.blob_dir = blob_dir
+        self.max_age = max_age
+        self.last_gc = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+    def path(self, ref):
+        return os.path.join(self.blob_dir, ref.digest)
+
+    def put(self, data, name='', mime_type=None):
+        """Store bytes or text and return its BlobRef; identical content is stored once"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        ref = BlobRef(hashlib.sha256(data).hexdigest(), len(data), name, mime_type)
+        path = self.path(ref)
+        if os.path.exists(path):
+            self.touch([ref])
+            return ref
+        atomic_write(path, data)
+        return ref
+
+    def put_stream(self, write, name='', mime_type=None):
+        """Store what write(fileobj) writes, without holding it in memory; returns its BlobRef"""
+        tmp_path = temp_path(os.path.join(self.blob_dir, 'stream'))
+        digest = hashlib.sha256()
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        with open(tmp_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        ref = BlobRef(digest.hexdigest(), os.path.getsize(tmp_path), name, mime_type)
+        os.replace(tmp_path, self.path(ref))
+        return ref
+
+    def put_file(self, file):
+        """Spill an uploaded file, keeping its name and MIME type on the handle"""
+        return self.put(read_image_bytes(file), file.name, file.type)
+
+    def open(self, ref):
+        """File object for a blob; memory-mapped unless it is empty"""
+        if ref.size == 0:
+            return ImageFile(b'', ref.name, ref.mime_type)
+        return MappedFile(self.path(ref), ref.name, ref.mime_type)
+
+    def read_bytes(self, ref):
+        with open(self.path(ref), 'rb') as f:
+            return f.read()
+
+    def read_text(self, ref):
+        return self.read_bytes(ref).decode('utf-8')
+
+    def touch(self, refs):
+        """Mark blobs as still referenced so gc() keeps them; returns the refs already gone"""
+        missing = []
+        for ref in refs:
+            try:
+                os.utime(self.path(ref), None)
+            except OSError:
+                missing.append(ref)
+        return missing
+
+    def gc(self, force=False):
+        """Delete blobs untouched for max_age; runs at most every GC_INTERVAL unless forced
+
+        Returns (blobs removed, bytes freed).
+        """
+        now = time.time()
+        with self._lock:
+            if not force and now - self.last_gc < GC_INTERVAL:
+                return 0, 0
+            self.last_gc = now
+            removed = freed = 0
+            for name in os.listdir(self.blob_dir):
+                path = os.path.join(self.blob_dir, name)
+                try:
+                    stat = os.stat(path)
+                    if now - stat.st_mtime > self.max_age:
+                        os.remove(path)
+                        removed += 1
+                        freed += stat.st_size
+                except OSError:
+                    continue
+            return removed, freed
+
+    def stats(self):
+        entries = 0
+        size = 0
+        for name in os.listdir(self.blob_dir):
+            try:
+                size += os.path.getsize(os.path.join(self.blob_dir, name))
+                entries += 1
+            except OSError:
+                pass
+        return {'entries': entries, 'bytes': size}
+
+
+class SessionBlobCache:
+    """Per-session LRU of decoded text blobs, capped at max_bytes
+
+    Text read on every rerun (the HTML being previewed) stays in memory up to
+    the session's ceiling; anything beyond is re-read from disk when needed.
+    """
+
+    def __init__(self, store, max_bytes=DEFAULT_SESSION_MEMORY):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items = OrderedDict()
+
+    def text(self, ref):
+        if ref.digest in self._items:
+            self._items.move_to_end(ref.digest)
+            return self._items[ref.digest][1]
+        text = self.store.read_text(ref)
+        if ref.size <= self.max_bytes:
+            self._items[ref.digest] = (ref.size, text)
+            self.bytes += ref.size
+            while self.bytes > self.max_bytes:
+                _, (size, _) = self._items.popitem(last=False)
+                self.bytes -= size
+        return text
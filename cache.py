@@ -0,0 +1,143 @@
+# cache.py
+import hashlib
+import os
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.environ.get("MOCKUP_CACHE_DIR", os.path.join(".cache", "generations"))
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # 256 MB of generated HTML
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60     # 30 days
+
+
+def make_cache_key(image_data, width, height, prompt, model_name):
+    """Build a content-addressed key from everything that affects the generation"""
+    digest = hashlib.sha256()
+    if isinstance(image_data, str):
+        image_data = image_data.encode('utf-8')
+    for part in (image_data, f"{width}x{height}".encode('utf-8'), prompt.encode('utf-8'), model_name.encode('utf-8')):
+        # Length-prefix each part so neighbouring fields can't collide
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def temp_path(path):
+    """A temp file name next to path, unique to this process and thread"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def atomic_write(path, data):
+    """Write text or bytes to path so concurrent readers never see a partial file"""
+    tmp_path = temp_path(path)
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class GenerationCache:
+    """Persistent on-disk cache of generated HTML with size/age based LRU eviction"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE, enabled=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        if enabled is None:
+            # MOCKUP_CACHE=0 switches the cache off without touching code
+            enabled = os.environ.get("MOCKUP_CACHE", "1") != "0"
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.html")
+
+    def get(self, key):
+        """Return cached HTML for key, or None on a miss"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            if self.max_age and time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                html = f.read()
+            # Touch the entry so eviction treats it as recently used
+            os.utime(path, None)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return html
+
+    def set(self, key, html):
+        """Store HTML under key and evict old entries if over budget"""
+        if not self.enabled:
+            return
+        atomic_write(self._path(key), html)
+        self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        now = time.time()
+        entries = []
+        total = 0
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.html'):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if self.max_age and now - stat.st_mtime > self.max_age:
+                    self._remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+            entries.sort()
+            while entries and self.max_bytes and total > self.max_bytes:
+                _, size, path = entries.pop(0)
+                self._remove(path)
+                total -= size
+
+    def clear(self):
+        """Remove every cached generation"""
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.html'):
+                    self._remove(os.path.join(self.cache_dir, name))
+
+    def stats(self):
+        """Return hit/miss counters and current disk usage"""
+        entries = 0
+        size = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.html'):
+                try:
+                    size += os.path.getsize(os.path.join(self.cache_dir, name))
+                    entries += 1
+                except OSError:
+                    pass
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': entries,
+            'bytes': size,
+            'enabled': self.enabled
+        }
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,138 @@
+# cascade.py
+"""Draft-then-refine generation with a fast and a stronger model"""
+import math
+import os
+import time
+
+import metrics
+from backends import make_backend
+from cache import make_cache_key
+from images import ImageFile, read_image_bytes
+from main import HTMLGenerator, extract_image_info
+from revision import image_ids_in_order, remap_placeholders
+from tiling import TOTAL_IMAGES_PATTERN
+
+STAGE_MODELS = {
+    'draft': os.environ.get("MOCKUP_DRAFT_MODEL", "gemini-2.5-flash"),
+    'refine': os.environ.get("MOCKUP_REFINE_MODEL", "gemini-2.5-pro")
+}
+# Pairs of image areas scoring above this are treated as different images
+RECONCILE_MAX_COST = 1.0
+
+
+def slot_layout(html_content):
+    """[(img_id, relative position in the document, width, height)] in document order"""
+    info = extract_image_info(html_content)
+    ids = image_ids_in_order(html_content)
+    slots = []
+    for index, img_id in enumerate(ids):
+        size = info.get(img_id, {})
+        position = index / (len(ids) - 1) if len(ids) > 1 else 0.0
+        slots.append((img_id, position, _number(size.get('width')), _number(size.get('height'))))
+    return slots
+
+
+def _number(value):
+    try:
+        return float(value) if value and float(value) > 0 else None
+    except ValueError:
+        return None
+
+
+def match_cost(draft_slot, refined_slot):
+    """How unlikely two image areas are to be the same: order distance plus log size ratio"""
+    cost = 2 * abs(draft_slot[1] - refined_slot[1])
+    for draft_size, refined_size in zip(draft_slot[2:], refined_slot[2:]):
+        cost += abs(math.log(draft_size / refined_size)) if draft_size and refined_size else 0.25
+    return cost
+
+
+def reconcile_placeholders(draft_html, refined_html, max_cost=RECONCILE_MAX_COST):
+    """Renumber refined_html's IMAGE_n ids to match the draft's
+
+    Areas are paired greedily by match_cost; refined areas without a draft
+    counterpart get fresh ids above the draft's. Returns (html, report) where
+    report lists the 'matched' pairs and the 'added' and 'dropped' ids.
+    """
+    draft = slot_layout(draft_html)
+    refined = slot_layout(refined_html)
+    pairs = sorted(
+        (match_cost(draft_slot, refined_slot), draft_slot[0], refined_slot[0])
+        for draft_slot in draft for refined_slot in refined
+    )
+    mapping = {}
+    used = set()
+    for cost, draft_id, refined_id in pairs:
+        if cost > max_cost:
+            break
+        if refined_id in mapping or draft_id in used:
+            continue
+        mapping[refined_id] = draft_id
+        used.add(draft_id)
+
+    next_id = max((slot[0] for slot in draft), default=0)
+    added = []
+    for refined_id, *_ in refined:
+        if refined_id not in mapping:
+            next_id += 1
+            mapping[refined_id] = next_id
+            added.append(next_id)
+
+    html = remap_placeholders(refined_html, mapping)
+    total = max(mapping.values(), default=0)
+    html = TOTAL_IMAGES_PATTERN.sub(f"<!-- TOTAL_IMAGES:{total} -->", html, count=1)
+    return html, {
+        'matched': sorted((draft_id, refined_id) for refined_id, draft_id in mapping.items() if draft_id in used),
+        'added': added,
+        'dropped': sorted(slot[0] for slot in draft if slot[0] not in used)
+    }
+
+
+class ModelCascade:
+    """A draft generator and a refine generator sharing one cache and job queue"""
+
+    def __init__(self, draft, refine):
+        self.draft = draft
+        self.refine = refine
+
+    @classmethod
+    def from_env(cls, cache=None, backend_name=None):
+        """Cascade with the models configured in STAGE_MODELS"""
+        generators = {
+            tier: HTMLGenerator(cache=cache, backend=make_backend(backend_name, model_name, tier=tier))
+            for tier, model_name in STAGE_MODELS.items()
+        }
+        return cls(generators['draft'], generators['refine'])
+
+    def submit_draft(self, image_file, image_width, image_height, use_cache=True, tiled=False):
+        """Queue the fast analysis; job.progress is filled like HTMLGenerator.analyze"""
+        design = ImageFile(read_image_bytes(image_file), image_file.name, image_file.type)
+        mode = 'tiled' if tiled else 'streamed'
+        key = make_cache_key(design.getvalue(), image_width, image_height, mode, self.draft.model_name)
+
+        def run(job):
+            with metrics.span('tier_draft', model=self.draft.model_name):
+                return self.draft.analyze(design, image_width, image_height, use_cache, tiled, progress=job.progress)
+
+        return self.draft.jobs.submit(key, run, kind=f"draft_{mode}")
+
+    def submit_refinement(self, image_file, image_width, image_height, draft_html, use_cache=True, tiled=False):
+        """Queue the refine model; the job's result is refined HTML renumbered to the draft's ids
+
+        job.progress['reconcile'] holds the reconcile_placeholders report and
+        job.progress['seconds'] the refine latency once the job is done.
+        """
+        design = ImageFile(read_image_bytes(image_file), image_file.name, image_file.type)
+        # The draft is part of the key: the result's ids depend on it
+        key = make_cache_key(design.getvalue(), image_width, image_height, draft_html, self.refine.model_name)
+
+        def run(job):
+            started = time.perf_counter()
+            with metrics.span('tier_refine', model=self.refine.model_name) as span:
+                html = self.refine.analyze(design, image_width, image_height, use_cache, tiled)
+                html, report = reconcile_placeholders(draft_html, html)
+                span.set(matched=len(report['matched']), added=len(report['added']), dropped=len(report['dropped']))
+            job.progress.update(reconcile=report, seconds=time.perf_counter() - started)
+            return html
+
+        return self.refine.jobs.submit(key, run, kind='refine')
@@ -0,0 +1,77 @@
+# client.py
+"""Process-wide Gemini client, imported and configured on first use"""
+import os
+import threading
+import time
+
+API_KEY_VARIABLES = ("GEMINI_API_KEY", "GOOGLE_API_KEY")
+
+_lock = threading.Lock()
+_genai = None
+_models = {}
+
+# Setup costs, so cold start and per-call overhead can be compared
+CLIENT_TIMINGS = {
+    'import_seconds': None,
+    'configure_seconds': None,
+    'model_seconds': {},
+    'model_lookups': 0
+}
+
+
+def get_api_key():
+    """Read the Gemini API key from the environment"""
+    for name in API_KEY_VARIABLES:
+        if os.environ.get(name):
+            return os.environ[name]
+    raise RuntimeError(f"Set {' or '.join(API_KEY_VARIABLES)} to your Gemini API key")
+
+
+def get_genai():
+    """Import and configure google.generativeai once per process"""
+    global _genai
+    if _genai is not None:
+        return _genai
+    with _lock:
+        if _genai is None:
+            started = time.perf_counter()
+            import google.generativeai as genai
+            import_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            genai.configure(api_key=get_api_key())
+            # Recorded together once configured, so a missing key leaves both unset
+            CLIENT_TIMINGS['configure_seconds'] = time.perf_counter() - started
+            CLIENT_TIMINGS['import_seconds'] = import_seconds
+            _genai = genai
+    return _genai
+
+
+def get_model(model_name):
+    """Shared GenerativeModel per model name; reusing it reuses its transport connection"""
+    CLIENT_TIMINGS['model_lookups'] += 1
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+    genai = get_genai()
+    with _lock:
+        model = _models.get(model_name)
+        if model is None:
+            started = time.perf_counter()
+            model = genai.GenerativeModel(model_name)
+            CLIENT_TIMINGS['model_seconds'][model_name] = time.perf_counter() - started
+            _models[model_name] = model
+    return model
+
+
+def client_stats():
+    """Setup timings in milliseconds for display"""
+    def ms(seconds):
+        return None if seconds is None else round(seconds * 1000, 1)
+    return {
+        'sdk_import_ms': ms(CLIENT_TIMINGS['import_seconds']),
+        'configure_ms': ms(CLIENT_TIMINGS['configure_seconds']),
+        'model_init_ms': {name: ms(s) for name, s in CLIENT_TIMINGS['model_seconds'].items()},
+        'model_lookups': CLIENT_TIMINGS['model_lookups'],
+        'cached_models': len(_models)
+    }
@@ -0,0 +1,75 @@
+# export.py
+import hashlib
+import mimetypes
+import shutil
+import zipfile
+
+from main import fill_placeholders, prepare_replacement_images, render_image_fragments
+
+ASSET_DIR = 'assets'
+# Images are already compressed, so only the HTML is deflated
+HTML_COMPRESSION = zipfile.ZIP_DEFLATED
+
+EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/gif': '.gif'
+}
+
+
+def asset_name(data, mime_type):
+    """Content-hashed relative path for an asset"""
+    extension = EXTENSIONS.get(mime_type) or mimetypes.guess_extension(mime_type or '') or '.bin'
+    return f"{ASSET_DIR}/{hashlib.sha256(data).hexdigest()[:16]}{extension}"
+
+
+def build_asset_bundle(html_content, image_replacements, image_info=None):
+    """Point placeholders at content-hashed asset files instead of data: URIs
+
+    Returns (index_html, assets, issues, stats) where assets maps relative
+    path -> bytes. Identical images used in several slots are stored once.
+    """
+    images = prepare_replacement_images(image_replacements, image_info)
+    assets = {}
+    stats = {'assets': 0, 'asset_bytes': 0, 'deduplicated': 0}
+
+    def url_for(variant):
+        name = asset_name(variant['data'], variant['mime_type'])
+        if name in assets:
+            stats['deduplicated'] += 1
+        else:
+            assets[name] = variant['data']
+            stats['assets'] += 1
+            stats['asset_bytes'] += len(variant['data'])
+        return name
+
+    fragments = render_image_fragments(images, url_for)
+    index_html, issues = fill_placeholders(html_content, fragments)
+    stats['index_bytes'] = len(index_html.encode('utf-8'))
+    return index_html, assets, issues, stats
+
+
+def write_asset_bundle(index_html, assets, fileobj, open_asset=None):
+    """Stream a zip of index.html plus assets into fileobj
+
+    fileobj may be any writable binary stream, including non-seekable ones;
+    entries are written one at a time rather than assembling the archive in memory.
+    assets maps path -> bytes, or path -> a handle that open_asset turns into a
+    readable file, so each asset is only read while its entry is written.
+    """
+    with zipfile.ZipFile(fileobj, 'w') as bundle:
+        info = zipfile.ZipInfo('index.html')
+        info.compress_type = HTML_COMPRESSION
+        with bundle.open(info, 'w') as entry:
+            entry.write(index_html.encode('utf-8'))
+        for name, data in assets.items():
+            with bundle.open(zipfile.ZipInfo(name), 'w') as entry:
+                if open_asset is None:
+                    entry.write(data)
+                    continue
+                source = open_asset(data)
+                try:
+                    shutil.copyfileobj(source, entry)
+                finally:
+                    source.close()
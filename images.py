@@ -0,0 +1,240 @@
+# images.py
+import base64
+import io
+import math
+import mimetypes
+import os
+import threading
+import time
+
+# Budgets for the mockup sent to Gemini. The model downsamples internally,
+# so anything much above this only costs upload time.
+MAX_UPLOAD_PIXELS = 2048 * 1536
+MAX_UPLOAD_BYTES = 2 * 1024 * 1024
+
+# Pixel densities generated for each replacement image (1x src, 2x srcset)
+SLOT_DENSITIES = (1, 2)
+SLOT_QUALITY = 80
+# Processes fitting replacement images, shared by every caller in the process
+FIT_WORKERS = int(os.environ.get("MOCKUP_FIT_WORKERS", os.cpu_count() or 1))
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'GIF': 'image/gif'
+}
+
+
+class ImageFile(io.BytesIO):
+    """In-memory image with the name/type attributes of a Streamlit UploadedFile"""
+
+    def __init__(self, data, name, mime_type=None):
+        super().__init__(data)
+        self.name = name
+        self.type = mime_type or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    @classmethod
+    def from_path(cls, path):
+        with open(path, 'rb') as f:
+            return cls(f.read(), os.path.basename(path))
+
+
+def read_image_bytes(image_file):
+    """Read the full contents of an uploaded file and rewind it"""
+    image_file.seek(0)
+    data = image_file.read()
+    image_file.seek(0)
+    return data
+
+
+# Pillow is imported inside the functions that need it so importing this
+# module (and main) stays cheap at app start-up.
+
+def _encode(image, fmt, quality):
+    buffer = io.BytesIO()
+    if fmt == 'WEBP':
+        image.save(buffer, format='WEBP', quality=quality, method=4)
+    else:
+        image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _output_format():
+    """Prefer WebP; fall back to JPEG where Pillow was built without it"""
+    from PIL import features
+    return 'WEBP' if features.check('webp') else 'JPEG'
+
+
+def preprocess_mockup(image_file, max_pixels=MAX_UPLOAD_PIXELS, max_bytes=MAX_UPLOAD_BYTES):
+    """Downscale and re-encode a mockup to fit the upload budget
+
+    Returns a dict with the base64 payload, its real MIME type, the sent and
+    original dimensions, and before/after payload sizes and encode times.
+    """
+    from PIL import Image
+    original_bytes = read_image_bytes(image_file)
+
+    # Baseline: what encode_image would have sent
+    start = time.perf_counter()
+    original_b64 = base64.b64encode(original_bytes).decode('utf-8')
+    original_encode_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image = Image.open(io.BytesIO(original_bytes))
+    original_width, original_height = image.size
+    source_mime = MIME_TYPES.get(image.format)
+
+    result = {
+        'original_width': original_width,
+        'original_height': original_height,
+        'original_payload_bytes': len(original_b64),
+        'original_encode_seconds': original_encode_seconds
+    }
+
+    pixels = original_width * original_height
+    if source_mime and source_mime != 'image/gif' and pixels <= max_pixels and len(original_bytes) <= max_bytes:
+        # Already within budget - send as-is, just with the correct MIME type
+        result.update({
+            'data': original_b64,
+            'mime_type': source_mime,
+            'width': original_width,
+            'height': original_height,
+            'payload_bytes': len(original_b64),
+            'encode_seconds': original_encode_seconds
+        })
+        return result
+
+    scale = min(1.0, math.sqrt(max_pixels / pixels)) if pixels else 1.0
+    fmt = _output_format()
+
+    while True:
+        width = max(1, int(original_width * scale))
+        height = max(1, int(original_height * scale))
+        if image.format == 'JPEG':
+            # Let libjpeg decode at reduced scale instead of full resolution
+            image.draft('RGB', (width, height))
+        frame = image.convert('RGBA' if fmt == 'WEBP' and image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        if frame.size != (width, height):
+            frame = frame.resize((width, height), Image.LANCZOS)
+
+        for quality in (85, 75, 65):
+            encoded = _encode(frame, fmt, quality)
+            if len(encoded) <= max_bytes:
+                break
+        if len(encoded) <= max_bytes or width <= 256 or height <= 256:
+            break
+        scale *= 0.8
+
+    data = base64.b64encode(encoded).decode('utf-8')
+    result.update({
+        'data': data,
+        'mime_type': MIME_TYPES[fmt],
+        'width': width,
+        'height': height,
+        'payload_bytes': len(data),
+        'encode_seconds': time.perf_counter() - start
+    })
+    return result
+
+
+def fit_to_slot(data, slot_width, slot_height, densities=SLOT_DENSITIES, quality=SLOT_QUALITY):
+    """Cover-crop and re-encode image bytes to a slot at each pixel density
+
+    Returns a list of variant dicts (density, width, height, mime_type, data),
+    or None for animated images, which are kept as uploaded. Module level so
+    it can run in worker processes.
+    """
+    from PIL import Image, ImageOps
+    image = Image.open(io.BytesIO(data))
+    if getattr(image, 'is_animated', False):
+        return None
+    fmt = _output_format()
+    if image.format == 'JPEG':
+        # Decode at the smallest scale that still covers the largest variant
+        image.draft('RGB', (slot_width * max(densities), slot_height * max(densities)))
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA', 'P') and fmt == 'WEBP'
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    variants = []
+    for density in sorted(densities):
+        width, height = slot_width * density, slot_height * density
+        # Never upscale: past the source resolution only an aspect-ratio crop is useful
+        scale = max(width / image.width, height / image.height)
+        if scale > 1:
+            if variants:
+                break
+            width, height = max(1, round(width / scale)), max(1, round(height / scale))
+        frame = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        variants.append({
+            'density': density,
+            'width': width,
+            'height': height,
+            'mime_type': MIME_TYPES[fmt],
+            'data': _encode(frame, fmt, quality)
+        })
+    return variants
+
+
+def _fit_job(job):
+    data, slot_width, slot_height, densities = job
+    try:
+        return fit_to_slot(data, slot_width, slot_height, densities)
+    except Exception:
+        # Unreadable or unsupported input: caller falls back to the original upload
+        return None
+
+
+_fit_pool = None
+_fit_pool_lock = threading.Lock()
+
+
+def _init_fit_worker():
+    # Load Pillow and its format plugins before the first job arrives
+    from PIL import Image
+    Image.init()
+
+
+def get_fit_pool():
+    """Process pool for fit_to_slot, started on first use and kept for the process lifetime
+
+    Workers are spawned rather than forked: callers run on many threads
+    (batch workers, Streamlit sessions, job-queue workers), and a child forked
+    while another thread holds an import lock deadlocks on its first import.
+    """
+    global _fit_pool
+    if _fit_pool is None:
+        with _fit_pool_lock:
+            if _fit_pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                _fit_pool = ProcessPoolExecutor(
+                    max_workers=FIT_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_fit_worker
+                )
+    return _fit_pool
+
+
+def fit_images_to_slots(jobs, densities=SLOT_DENSITIES):
+    """Run fit_to_slot for {img_id: (data, width, height)} across the shared process pool"""
+    ids = list(jobs)
+    args = [(jobs[i][0], jobs[i][1], jobs[i][2], densities) for i in ids]
+    if len(args) <= 1:
+        # Not worth a round trip to the workers for a single image
+        results = [_fit_job(job) for job in args]
+    else:
+        results = list(get_fit_pool().map(_fit_job, args))
+    return dict(zip(ids, results))
+
+
+def slot_size(info):
+    """Parse (width, height) from an extract_image_info entry, or None if unusable"""
+    try:
+        width, height = int(info['width']), int(info['height'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if width <= 0 or height <= 0:
+        return None
+    return width, height
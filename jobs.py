@@ -0,0 +1,183 @@
+# jobs.py
+"""Background generation jobs on a process-wide pool, deduplicated by key"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+DEFAULT_WORKERS = int(os.environ.get("MOCKUP_JOB_WORKERS", "4"))
+DEFAULT_MAX_PENDING = int(os.environ.get("MOCKUP_JOB_MAX_PENDING", "32"))
+# Finished jobs are kept this long so every subscribed session can collect the result
+FINISHED_JOB_TTL = 15 * 60
+
+
+class QueueFullError(RuntimeError):
+    """More jobs are waiting than the queue accepts"""
+
+
+class Job:
+    """One queued generation; progress is filled in by the running function"""
+
+    def __init__(self, job_id, key, kind):
+        self.id = job_id
+        self.key = key
+        self.kind = kind
+        self.state = 'queued'
+        self.subscribers = 1
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def wait_seconds(self):
+        """Time spent queued before a worker picked the job up (so far, if still queued)"""
+        return (self.started or time.perf_counter()) - self.submitted
+
+    @property
+    def run_seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def wait(self, timeout=None):
+        """Block until the job finishes; returns its result or re-raises its error"""
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Job {self.id} still {self.state}")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class JobQueue:
+    """Bounded worker pool with single-flight deduplication by key"""
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+        self._jobs = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+
+    def submit(self, key, func, kind='generate'):
+        """Run func(job) on the pool, or return the in-flight job with the same key"""
+        with self._lock:
+            self._expire()
+            job = self._inflight.get(key)
+            if job is not None:
+                job.subscribers += 1
+                self.coalesced += 1
+                metrics.incr('jobs_coalesced', kind=kind)
+                return job
+            queued = self._count('queued')
+            if queued >= self.max_pending:
+                metrics.incr('jobs_rejected', kind=kind)
+                raise QueueFullError(f"{queued} jobs already waiting; try again shortly")
+            job = Job(uuid.uuid4().hex[:12], key, kind)
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+            self.submitted += 1
+            self._publish()
+        metrics.incr('jobs_submitted', kind=kind)
+        self._pool.submit(self._run, job, func)
+        return job
+
+    def _run(self, job, func):
+        with self._lock:
+            job.started = time.perf_counter()
+            job.state = 'running'
+            self._publish()
+        metrics.record('job_wait', job.wait_seconds, kind=job.kind)
+        try:
+            with metrics.span('job_run', kind=job.kind, subscribers=job.subscribers):
+                job.result = func(job)
+        except Exception as e:
+            job.error = e
+        with self._lock:
+            job.finished = time.perf_counter()
+            job.state = 'failed' if job.error is not None else 'done'
+            if job.error is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+            if self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+            self._publish()
+        job._done.set()
+
+    def get(self, job_id):
+        """The job with this id, or None once it has expired"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        """How many queued jobs were submitted before this one"""
+        with self._lock:
+            if job.state != 'queued':
+                return 0
+            ahead = 0
+            for other in self._jobs.values():
+                if other is job:
+                    return ahead
+                if other.state == 'queued':
+                    ahead += 1
+            return ahead
+
+    def stats(self):
+        with self._lock:
+            waits = [job.wait_seconds for job in self._jobs.values() if job.started is not None]
+            return {
+                'workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'queued': self._count('queued'),
+                'running': self._count('running'),
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait_seconds': sum(waits) / len(waits) if waits else 0.0
+            }
+
+    def _count(self, state):
+        return sum(1 for job in self._jobs.values() if job.state == state)
+
+    def _expire(self):
+        now = time.perf_counter()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and now - job.finished > FINISHED_JOB_TTL]:
+            del self._jobs[job_id]
+
+    def _publish(self):
+        metrics.gauge('jobs_queued', self._count('queued'))
+        metrics.gauge('jobs_running', self._count('running'))
+        metrics.gauge('job_workers', self.max_workers)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Process-wide queue shared by every session, created on first use"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
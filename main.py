@@ -1,16 +1,36 @@
 # main.py
 import base64
-import google.generativeai as genai
 import re
-from PIL import Image
+import metrics
+import time
+from cache import GenerationCache, make_cache_key
+from backends import GeminiBackend
+from concurrent.futures import ThreadPoolExecutor
+from images import (MAX_UPLOAD_BYTES, MAX_UPLOAD_PIXELS, ImageFile, fit_images_to_slots, preprocess_mockup,
+                    read_image_bytes, slot_size)
+from jobs import get_job_queue
+from revision import revise
+from tiling import BAND_OVERLAP, band_bounds, build_band_prompt, crop_bands, stitch_sections
 
 class HTMLGenerator:
-    def __init__(self):
-        # Configure Gemini with your hardcoded API key
-        api_key = ""  # ← PUT YOUR ACTUAL KEY HERE
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-pro')
+    def __init__(self, model_name='gemini-2.5-pro', cache=None,
+                 max_upload_pixels=MAX_UPLOAD_PIXELS, max_upload_bytes=MAX_UPLOAD_BYTES, backend=None, jobs=None):
+        # Gemini by default: the client is shared process-wide and created on
+        # first use, with the API key from GEMINI_API_KEY / GOOGLE_API_KEY.
+        # Pass e.g. backends.StubBackend() to run offline.
+        self.backend = backend or GeminiBackend(model_name)
+        self.model_name = self.backend.model_name
+        # Generations are cached on disk by default; pass cache=False to bypass
+        if cache is None:
+            cache = GenerationCache()
+        self.cache = cache or None
+        self.max_upload_pixels = max_upload_pixels
+        self.max_upload_bytes = max_upload_bytes
+        # Background analyses share the process-wide job queue unless one is given
+        self.jobs = jobs or get_job_queue()
+        self.last_replacement_issues = []
     
+    @metrics.traced('encode_image')
     def encode_image(self, image_file):
         """Encode uploaded image to base64 (original size)"""
         # Reset file pointer to beginning
@@ -18,10 +38,16 @@ class HTMLGenerator:
         image_bytes = image_file.read()
         return base64.b64encode(image_bytes).decode('utf-8')
     
-    def generate_html_with_image_placeholders(self, image_b64, image_width, image_height):
-        """Generate HTML code from image using Gemini with original dimensions"""
-        try:
-            prompt = f"""
+    def prepare_image(self, image_file):
+        """Downscale/re-encode the design to the upload budget and report payload savings"""
+        with metrics.span('prepare_image') as span:
+            payload = preprocess_mockup(image_file, self.max_upload_pixels, self.max_upload_bytes)
+            span.set(original_bytes=payload['original_payload_bytes'], payload_bytes=payload['payload_bytes'])
+        return payload
+    
+    def build_prompt(self, image_width, image_height):
+        """Build the analysis prompt for a design of the given dimensions"""
+        return f"""
             Analyze this image and create EXACT HTML code that matches the design pixel-perfect. 
             The original image dimensions are {image_width}x{image_height} pixels.
 
@@ -48,37 +74,304 @@ class HTMLGenerator:
             Output ONLY the HTML code.
             """
 
-            response = self.model.generate_content([
-                prompt,
-                {"mime_type": "image/jpeg", "data": image_b64}
-            ])
-            
-            return response.text
+    def generate_html_with_image_placeholders(self, image_b64, image_width, image_height, use_cache=True,
+                                              mime_type="image/jpeg", stream=False, prompt=None):
+        """Generate HTML code from image using Gemini with original dimensions
+
+        With stream=True, returns an iterator of text chunks as the model writes them.
+        A custom prompt replaces build_prompt (used for tiled bands).
+        """
+        if stream:
+            return self._generate_stream(image_b64, image_width, image_height, use_cache, mime_type, prompt)
+        try:
+            with metrics.span('generate', model=self.model_name) as span:
+                prompt = prompt or self.build_prompt(image_width, image_height)
+
+                # Identical image + size + prompt + model always yields a reusable result
+                cache_key = None
+                if use_cache and self.cache is not None:
+                    cache_key = make_cache_key(image_b64, image_width, image_height, prompt, self.model_name)
+                    cached_html = self.cache.get(cache_key)
+                    if cached_html is not None:
+                        span.set(cached=True, response_bytes=len(cached_html))
+                        return cached_html
+
+                bytes_sent = len(prompt.encode('utf-8')) + len(image_b64)
+                html = self.backend.generate(prompt, image_b64, mime_type)
+                record_generation(span, self.model_name, bytes_sent, html)
+                
+                if cache_key is not None:
+                    self.cache.set(cache_key, html)
+                
+                return html
             
         except Exception as e:
             raise Exception(f"Error: {str(e)}")
     
-    def replace_image_placeholders(self, html_content, image_replacements):
-        """Replace placeholders with actual uploaded images"""
-        for img_id, image_file in image_replacements.items():
-            # Reset file pointer and encode image
-            image_file.seek(0)
-            image_b64 = base64.b64encode(image_file.read()).decode('utf-8')
-            mime_type = image_file.type
-            
-            # Create img tag with uploaded image
-            img_tag = f'<img src="data:{mime_type};base64,{image_b64}" alt="Uploaded image {img_id}" style="width: 100%; height: auto; display: block;">'
-            
-            # Replace the placeholder area
-            start_pattern = f'<!-- IMAGE_START_{img_id} -->'
-            end_pattern = f'<!-- IMAGE_END_{img_id} -->'
+    def _generate_stream(self, image_b64, image_width, image_height, use_cache, mime_type, prompt=None):
+        """Yield the generated HTML chunk by chunk, caching the full document at the end"""
+        try:
+            with metrics.span('generate', model=self.model_name, stream=True) as span:
+                prompt = prompt or self.build_prompt(image_width, image_height)
+
+                cache_key = None
+                if use_cache and self.cache is not None:
+                    cache_key = make_cache_key(image_b64, image_width, image_height, prompt, self.model_name)
+                    cached_html = self.cache.get(cache_key)
+                    if cached_html is not None:
+                        span.set(cached=True, response_bytes=len(cached_html))
+                        yield cached_html
+                        return
+
+                bytes_sent = len(prompt.encode('utf-8')) + len(image_b64)
+                started = time.perf_counter()
+                chunks = []
+                for text in self.backend.stream(prompt, image_b64, mime_type):
+                    if not chunks:
+                        span.set(first_chunk_ms=round((time.perf_counter() - started) * 1000, 1))
+                    chunks.append(text)
+                    yield text
+                html = ''.join(chunks)
+                record_generation(span, self.model_name, bytes_sent, html)
+
+                # Only complete documents go into the cache
+                if cache_key is not None:
+                    self.cache.set(cache_key, html)
+
+        except Exception as e:
+            raise Exception(f"Error: {str(e)}")
+    
+    def generate_html_tiled(self, image_file, image_width, image_height, use_cache=True,
+                            band_height=None, overlap=BAND_OVERLAP, max_workers=8, band_runner=None):
+        """Analyze a tall mockup as overlapping horizontal bands in parallel
+
+        Bands are generated concurrently and stitched into one document whose
+        IMAGE_n ids are globally unique, so wall-clock time tracks the slowest
+        band instead of the whole page. Sections keep SECTION_START_k markers
+        with their pixel range. band_runner(func), when given, wraps each
+        band's model call; batch uses it for per-band rate limiting and retries.
+        """
+        bounds = band_bounds(image_width, image_height, band_height, overlap)
+        with metrics.span('crop_bands', bands=len(bounds)):
+            bands = crop_bands(image_file, bounds)
+
+        def generate_band(index):
+            def call():
+                return self.generate_band(bands[index], image_width, image_height, bounds[index],
+                                          index + 1, len(bounds), overlap, use_cache)
+            return band_runner(call) if band_runner else call()
+
+        with metrics.span('generate_tiled', model=self.model_name, bands=len(bounds)):
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(bounds))) as pool:
+                fragments = list(pool.map(generate_band, range(len(bounds))))
+            return stitch_sections(fragments, bounds)
+    
+    def generate_band(self, band_file, image_width, image_height, bounds, index, count, overlap, use_cache=True):
+        """Generate the HTML fragment for one cropped band of a page"""
+        top, bottom = bounds
+        payload = self.prepare_image(band_file)
+        prompt = build_band_prompt(image_width, image_height, top, bottom, index, count, overlap)
+        return self.generate_html_with_image_placeholders(
+            payload['data'], image_width, bottom - top,
+            use_cache=use_cache, mime_type=payload['mime_type'], prompt=prompt
+        )
+    
+    def revise_html(self, previous_html, previous_file, revised_file, image_width, image_height,
+                    use_cache=True, max_workers=8):
+        """Regenerate only the sections of previous_html whose region changed in the revised mockup
+
+        Returns (html, report). Unchanged sections and their IMAGE_n ids are kept;
+        see revision.revise for when a full tiled regeneration happens instead.
+        """
+        with metrics.span('revise_html', model=self.model_name) as span:
+            html, report = revise(self, previous_html, previous_file, revised_file,
+                                  image_width, image_height, use_cache, max_workers)
+            span.set(mode=report['mode'], regenerated=len(report['regenerated']), sections=report['sections'])
+        return html, report
+    
+    def analyze(self, image_file, image_width, image_height, use_cache=True, tiled=False, progress=None):
+        """Step 2 analysis of a design, tiled or streamed, reporting into the progress dict
+
+        A streamed analysis puts the upload 'payload', the live 'parser' and
+        'first_chunk_seconds' in progress; a tiled one reports 'bands'.
+        """
+        progress = {} if progress is None else progress
+        if tiled:
+            progress['bands'] = len(band_bounds(image_width, image_height))
+            return self.generate_html_tiled(image_file, image_width, image_height, use_cache=use_cache)
+        started = time.perf_counter()
+        # Downscaled payload, but the prompt keeps the original dimensions
+        payload = self.prepare_image(image_file)
+        parser = PlaceholderStreamParser()
+        progress.update(payload=payload, parser=parser)
+        for chunk in self.generate_html_with_image_placeholders(
+            payload['data'], image_width, image_height,
+            use_cache=use_cache, mime_type=payload['mime_type'], stream=True
+        ):
+            progress.setdefault('first_chunk_seconds', time.perf_counter() - started)
+            parser.feed(chunk)
+        return parser.text
+    
+    def submit_analysis(self, image_file, image_width, image_height, use_cache=True, tiled=False):
+        """Queue analyze() on the job pool and return its jobs.Job
+
+        Identical designs already queued or running share one job; the job's
+        progress dict is the one analyze() reports into.
+        """
+        # Own copy of the bytes: the caller's file object stays with its session
+        design = ImageFile(read_image_bytes(image_file), image_file.name, image_file.type)
+        mode = 'tiled' if tiled else 'streamed'
+        key = make_cache_key(design.getvalue(), image_width, image_height, mode, self.model_name)
+        return self.jobs.submit(
+            key,
+            lambda job: self.analyze(design, image_width, image_height, use_cache, tiled, progress=job.progress),
+            kind=f"analysis_{mode}"
+        )
+    
+    def replace_image_placeholders(self, html_content, image_replacements, issues=None, image_info=None):
+        """Replace placeholders with actual uploaded images
+
+        With image_info (from extract_image_info), each upload is cover-cropped to
+        its slot size and re-encoded at 1x/2x in a process pool; otherwise the raw
+        upload is inlined. Marker problems (missing, unmatched or duplicated
+        START/END pairs) are reported in self.last_replacement_issues, and
+        appended to `issues` when given (use that from worker threads sharing
+        one generator).
+        """
+        with metrics.span('replace_image_placeholders', images=len(image_replacements)) as span:
+            images = prepare_replacement_images(image_replacements, image_info)
+            with metrics.span('inline_images'):
+                fragments = render_image_fragments(
+                    images,
+                    lambda variant: f"data:{variant['mime_type']};base64,{base64.b64encode(variant['data']).decode('utf-8')}"
+                )
             
-            # Find the content between start and end markers
-            pattern = f'{re.escape(start_pattern)}.*?{re.escape(end_pattern)}'
-            html_content = re.sub(pattern, f'{start_pattern}{img_tag}{end_pattern}', html_content, flags=re.DOTALL)
-        
+            html_content, found_issues = fill_placeholders(html_content, fragments)
+            span.set(output_bytes=len(html_content), issues=len(found_issues))
+            metrics.incr('images_replaced', len(image_replacements))
+        self.last_replacement_issues = found_issues
+        if issues is not None:
+            issues.extend(found_issues)
         return html_content
 
+def record_generation(span, model_name, bytes_sent, html):
+    """Attach request/response sizes to a generation span and its counters"""
+    response_bytes = len(html.encode('utf-8'))
+    span.set(bytes_sent=bytes_sent, response_bytes=response_bytes)
+    metrics.incr('bytes_sent', bytes_sent, model=model_name)
+    metrics.incr('response_bytes', response_bytes, model=model_name)
+    metrics.incr('generations', model=model_name)
+
+def prepare_replacement_images(image_replacements, image_info=None):
+    """Read uploads into {img_id: [variant, ...]}, fitted to their slots when sizes are known
+
+    Variants are dicts with density, width, height, mime_type and data (1x first).
+    A raw upload is a single 1x variant without width/height.
+    """
+    uploads = {}
+    for img_id, image_file in image_replacements.items():
+        # Reset file pointer and read image
+        image_file.seek(0)
+        uploads[int(img_id)] = (image_file.read(), image_file.type)
+    
+    fitted = {}
+    if image_info:
+        jobs = {}
+        for img_id, (data, _) in uploads.items():
+            size = slot_size(image_info.get(img_id, {}))
+            if size:
+                jobs[img_id] = (data, size[0], size[1])
+        with metrics.span('fit_images_to_slots', images=len(jobs)):
+            fitted = fit_images_to_slots(jobs)
+    
+    images = {}
+    for img_id, (data, mime_type) in uploads.items():
+        images[img_id] = fitted.get(img_id) or [
+            {'density': 1, 'width': None, 'height': None, 'mime_type': mime_type, 'data': data}
+        ]
+    return images
+
+def render_image_fragments(images, url_for):
+    """Build the <img> fragment for each slot, with url_for(variant) giving each source URL"""
+    fragments = {}
+    for img_id, variants in images.items():
+        sources = [(url_for(variant), variant['density']) for variant in variants]
+        fragments[img_id] = build_img_tag(img_id, sources, variants[0]['width'], variants[0]['height'])
+    return fragments
+
+def build_img_tag(img_id, sources, width=None, height=None):
+    """Build the <img> for a slot from (url, density) sources, 1x first"""
+    attributes = f'src="{sources[0][0]}"'
+    if len(sources) > 1:
+        srcset = ', '.join(f'{url} {density}x' for url, density in sources)
+        attributes += f' srcset="{srcset}"'
+    if width and height:
+        # Intrinsic size lets the browser reserve layout before decoding
+        attributes += f' width="{width}" height="{height}" decoding="async"'
+    return f'<img {attributes} alt="Uploaded image {img_id}" style="width: 100%; height: auto; display: block;">'
+
+MARKER_PATTERN = re.compile(r'<!-- IMAGE_(START|END)_(\d+) -->')
+
+def index_image_markers(html_content):
+    """Find every IMAGE_START_n ... IMAGE_END_n span in a single scan
+
+    Returns (spans, issues) where spans is a list of (img_id, content_start,
+    content_end) offsets in document order and issues lists marker problems.
+    """
+    spans = []
+    issues = []
+    open_starts = {}
+    for match in MARKER_PATTERN.finditer(html_content):
+        kind, img_id = match.group(1), int(match.group(2))
+        if kind == 'START':
+            if img_id in open_starts:
+                issues.append(f"IMAGE_START_{img_id} appears again before its IMAGE_END_{img_id}")
+                continue
+            open_starts[img_id] = match.end()
+        elif img_id in open_starts:
+            spans.append((img_id, open_starts.pop(img_id), match.start()))
+        else:
+            issues.append(f"IMAGE_END_{img_id} has no matching IMAGE_START_{img_id}")
+    for img_id in open_starts:
+        issues.append(f"IMAGE_START_{img_id} has no matching IMAGE_END_{img_id}")
+
+    spans.sort(key=lambda span: span[1])
+    seen = set()
+    for img_id, _, _ in spans:
+        if img_id in seen:
+            issues.append(f"IMAGE_{img_id} placeholder appears more than once")
+        seen.add(img_id)
+    return spans, issues
+
+@metrics.traced('fill_placeholders')
+def fill_placeholders(html_content, fragments):
+    """Put fragments[img_id] between each IMAGE_START/END pair in one pass
+
+    Returns (html, issues). Output is assembled with a single join, so cost is
+    linear in document size regardless of the number of images.
+    """
+    spans, issues = index_image_markers(html_content)
+    pieces = []
+    position = 0
+    filled = set()
+    for img_id, content_start, content_end in spans:
+        if img_id not in fragments:
+            continue
+        if content_start < position:
+            issues.append(f"IMAGE_{img_id} placeholder overlaps another placeholder and was not replaced")
+            continue
+        pieces.append(html_content[position:content_start])
+        pieces.append(fragments[img_id])
+        position = content_end
+        filled.add(img_id)
+    pieces.append(html_content[position:])
+
+    for img_id in sorted(set(fragments) - filled):
+        if not any(span[0] == img_id for span in spans):
+            issues.append(f"No placeholder found for IMAGE_{img_id}")
+    return ''.join(pieces), issues
+
+@metrics.traced('extract_image_info')
 def extract_image_info(html_content):
     """Extract information about image placeholders from HTML"""
     image_info = {}
@@ -116,10 +409,89 @@ def extract_image_info(html_content):
     
     return image_info
 
+class PlaceholderStreamParser:
+    """Incrementally parse IMAGE_n markers from streamed HTML chunks"""
+
+    IMAGE_PATTERN = re.compile(r'<!-- IMAGE_(\d+): width=(\d+) height=(\d+) (.*?) -->')
+    TOTAL_PATTERN = re.compile(r'<!-- TOTAL_IMAGES:(\d+) -->')
+
+    def __init__(self):
+        self.chunks = []
+        self.image_info = {}
+        self.total_images = None
+        self._buffer = ''
+
+    @property
+    def text(self):
+        return ''.join(self.chunks)
+
+    def snapshot(self):
+        """Copy of the parsed state, safe to read while another thread keeps feeding"""
+        copy = PlaceholderStreamParser()
+        copy.chunks = list(self.chunks)
+        copy.image_info = dict(self.image_info)
+        copy.total_images = self.total_images
+        return copy
+
+    def feed(self, chunk):
+        """Consume a chunk and return the ids of image markers completed by it"""
+        self.chunks.append(chunk)
+        # Only the unparsed tail is kept; a marker split across chunks stays in it
+        self._buffer += chunk
+
+        if self.total_images is None:
+            total_match = self.TOTAL_PATTERN.search(self._buffer)
+            if total_match:
+                self.total_images = int(total_match.group(1))
+
+        new_ids = []
+        parsed_to = 0
+        for match in self.IMAGE_PATTERN.finditer(self._buffer):
+            img_id, width, height, description = match.groups()
+            img_id = int(img_id)
+            if img_id not in self.image_info:
+                self.image_info[img_id] = {
+                    'width': width,
+                    'height': height,
+                    'description': description.strip(),
+                    'uploaded': False
+                }
+                new_ids.append(img_id)
+            parsed_to = match.end()
+
+        # Keep everything from the last unterminated comment onwards
+        open_comment = self._buffer.rfind('<!--', parsed_to)
+        if open_comment != -1 and '-->' not in self._buffer[open_comment:]:
+            self._buffer = self._buffer[open_comment:]
+        else:
+            # A trailing '<!-' may still become a marker
+            self._buffer = self._buffer[-3:]
+        return new_ids
+
+def create_full_preview_html(html_content, original_width, original_height):
+    """Wrap the HTML content to display at full size without scrolling"""
+    # Calculate a scaled height for the iframe to show full content
+    # Use the original height but cap it at 800px for reasonable display
+    display_height = min(original_height, 800)
+    
+    # Create a wrapper that shows the full HTML without internal scrolling
+    wrapper_html = f"""
+    <div style="width: 100%; height: {display_height}px; overflow: visible; transform-origin: top left;">
+        <div style="transform: scale(0.8); transform-origin: top left; width: 125%;">
+            {html_content}
+        </div>
+    </div>
+    """
+    return wrapper_html, display_height
+
 def get_image_dimensions(image_file):
-    """Get original image dimensions"""
+    """Get original image dimensions (only the image header is read)"""
     try:
-        image = Image.open(image_file)
+        from PIL import Image
+        image_file.seek(0)
+        image = Image.open(image_file)  # lazy: pixel data is not decoded
         return image.size  # (width, height)
     except:
-        return (0, 0)
\ No newline at end of file
+        return (0, 0)
+    finally:
+        image_file.seek(0)
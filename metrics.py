@@ -0,0 +1,205 @@
+# metrics.py
+"""Per-stage timing spans and counters, exported as JSON traces or Prometheus text"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from cache import atomic_write
+
+# Histogram buckets in seconds, from regex passes up to full model calls
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RECENT_SPANS = 200
+
+
+class Span:
+    """A timed stage; attributes can be added while it runs"""
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.duration = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class MetricsRegistry:
+    """Thread-safe store of span aggregates, counters and recent traces"""
+
+    def __init__(self, trace_file=None):
+        self.trace_file = trace_file
+        self.counters = {}
+        self.gauges = {}
+        self.spans = {}
+        self.recent = deque(maxlen=RECENT_SPANS)
+        self._lock = threading.Lock()
+
+    def record_span(self, span):
+        record = {
+            'ts': round(time.time(), 3),
+            'name': span.name,
+            'duration_ms': round(span.duration * 1000, 3),
+            'thread': threading.current_thread().name,
+            'attrs': span.attrs
+        }
+        with self._lock:
+            stats = self.spans.setdefault(span.name, {
+                'count': 0, 'sum': 0.0, 'max': 0.0, 'errors': 0, 'buckets': [0] * len(BUCKETS)
+            })
+            stats['count'] += 1
+            stats['sum'] += span.duration
+            stats['max'] = max(stats['max'], span.duration)
+            if 'error' in span.attrs:
+                stats['errors'] += 1
+            for i, bound in enumerate(BUCKETS):
+                if span.duration <= bound:
+                    stats['buckets'][i] += 1
+            self.recent.append(record)
+            if self.trace_file:
+                with open(self.trace_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, default=str) + '\n')
+
+    def incr(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def snapshot(self):
+        """Copies of span aggregates and counters for display"""
+        with self._lock:
+            spans = {name: dict(stats, buckets=list(stats['buckets'])) for name, stats in self.spans.items()}
+            counters = dict(self.counters)
+        return spans, counters
+
+    def traces_jsonl(self):
+        with self._lock:
+            return ''.join(json.dumps(record, default=str) + '\n' for record in self.recent)
+
+    def prometheus_text(self):
+        """Render aggregates in the Prometheus text exposition format"""
+        spans, counters = self.snapshot()
+        lines = []
+        if spans:
+            lines.append('# HELP mockup_stage_seconds Duration of pipeline stages')
+            lines.append('# TYPE mockup_stage_seconds histogram')
+        for name, stats in sorted(spans.items()):
+            for bound, count in zip(BUCKETS, stats['buckets']):
+                lines.append(f'mockup_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'mockup_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {stats["count"]}')
+            lines.append(f'mockup_stage_seconds_sum{{stage="{name}"}} {stats["sum"]:.6f}')
+            lines.append(f'mockup_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+        if spans:
+            lines.append('# TYPE mockup_stage_errors_total counter')
+        for name, stats in sorted(spans.items()):
+            lines.append(f'mockup_stage_errors_total{{stage="{name}"}} {stats["errors"]}')
+
+        with self._lock:
+            gauges = dict(self.gauges)
+        declared = set()
+        for kind, values in (('counter', counters), ('gauge', gauges)):
+            for (name, labels), value in sorted(values.items()):
+                metric = f'mockup_{name}_total' if kind == 'counter' else f'mockup_{name}'
+                if metric not in declared:
+                    lines.append(f'# TYPE {metric} {kind}')
+                    declared.add(metric)
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels)
+                lines.append(f'{metric}{{{label_text}}} {value}' if label_text else f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Atomically write the Prometheus text to a file (e.g. for node_exporter's textfile collector)"""
+        atomic_write(path, self.prometheus_text())
+
+
+REGISTRY = MetricsRegistry(trace_file=os.environ.get("MOCKUP_TRACE_FILE"))
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a block; exceptions are recorded on the span and re-raised"""
+    current = Span(name, attrs)
+    started = time.perf_counter()
+    try:
+        yield current
+    except GeneratorExit:
+        # A streaming consumer stopped early; not a failure of the stage
+        current.attrs['abandoned'] = True
+        raise
+    except BaseException as e:
+        current.attrs['error'] = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        REGISTRY.record_span(current)
+
+
+def traced(name):
+    """Decorator form of span() for functions without extra attributes"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def incr(name, value=1, **labels):
+    """Add to a counter, e.g. incr('bytes_sent', 1024, model='gemini-2.5-pro')"""
+    REGISTRY.incr(name, value, **labels)
+
+
+def gauge(name, value, **labels):
+    """Set a point-in-time value, e.g. gauge('jobs_queued', 3)"""
+    REGISTRY.set_gauge(name, value, **labels)
+
+
+def record(name, seconds, **attrs):
+    """Record a span measured elsewhere, e.g. time spent waiting in a queue"""
+    current = Span(name, attrs)
+    current.duration = seconds
+    REGISTRY.record_span(current)
+
+
+def export_metrics_file(path=None):
+    """Write Prometheus text to path or $MOCKUP_METRICS_FILE, if either is set"""
+    path = path or os.environ.get("MOCKUP_METRICS_FILE")
+    if path:
+        REGISTRY.write_prometheus(path)
+    return path
+
+
+_server = None
+
+
+def start_metrics_server(port):
+    """Serve /metrics in a daemon thread (idempotent per process)"""
+    global _server
+    if _server is not None:
+        return _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = REGISTRY.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    _server = ThreadingHTTPServer(('', port), MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+    return _server
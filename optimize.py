@@ -0,0 +1,319 @@
+# optimize.py
+"""Shrink generated HTML before images are inlined"""
+import hashlib
+import re
+import time
+
+import metrics
+from main import MARKER_PATTERN, extract_image_info
+from project import parse_css
+
+# Inline styles repeated at least this often become a class
+MIN_STYLE_REUSE = 2
+# Body markup treated as above the fold, about one network round trip's worth
+FOLD_BYTES = 14 * 1024
+STYLE_CLASS_PREFIX = 'st-'
+PROTECTED_COMMENT_PATTERN = re.compile(r'^\s*(?:TOTAL_IMAGES:|IMAGE_|SECTION_(?:START|END)_|COMPONENT:)')
+PRESERVE_WHITESPACE_TAGS = ('pre', 'textarea', 'script', 'style')
+PRESERVE_WHITESPACE_CSS = re.compile(r'white-space\s*:\s*(?:pre|break-spaces)', re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+CSS_STRING = r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\''
+# State and generated-content pseudo-classes never match in a static tree; strip them before matching
+DYNAMIC_PSEUDO_PATTERN = re.compile(
+    r'::?(?:hover|focus(?:-within|-visible)?|active|visited|link|target|checked|disabled|enabled|before|after|'
+    r'placeholder|selection|first-line|first-letter|marker|backdrop|-webkit-[\w-]+|-moz-[\w-]+)(?![\w-])'
+)
+# Longhands whose shorthand doesn't share their prefix
+SHORTHAND_FAMILIES = {
+    'top': 'inset', 'right': 'inset', 'bottom': 'inset', 'left': 'inset',
+    'row-gap': 'gap', 'column-gap': 'gap', 'grid-gap': 'gap', 'grid-row-gap': 'gap', 'grid-column-gap': 'gap',
+    'columns': 'column'
+}
+
+
+def property_family(name):
+    """The shorthand a property belongs to: margin-top -> margin, border-left-color -> border"""
+    name = re.sub(r'^-[a-z]+-', '', name)
+    if name.startswith(('align-', 'justify-')):
+        return 'place'
+    return SHORTHAND_FAMILIES.get(name, name).split('-')[0]
+
+
+def property_families(declarations):
+    return {property_family(name) for name, _ in split_declarations(declarations or '')}
+
+
+def families_overlap(first, second):
+    """Whether two sets of property families can set the same property ('all' sets every one)"""
+    return bool(first & second) or bool(first and 'all' in second) or bool(second and 'all' in first)
+
+
+def split_declarations(text):
+    """[(property, value)] from a declaration block, respecting quotes and url(...;...)"""
+    declarations = []
+    depth = 0
+    quote = None
+    start = 0
+    for index, char in enumerate(text + ';'):
+        if quote:
+            if char == quote and text[index - 1] != '\\':
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(0, depth - 1)
+        elif char == ';' and depth == 0:
+            name, _, value = text[start:index].partition(':')
+            if name.strip() and value.strip():
+                declarations.append((name.strip().lower(), _squeeze(value)))
+            start = index + 1
+    return declarations
+
+
+def _squeeze(value):
+    """Collapse whitespace in a CSS value and drop it around commas, leaving strings alone"""
+    value = ' '.join(value.split())
+    return re.sub(rf'({CSS_STRING})|\s*,\s*|\s*(!important)', lambda m: m.group(1) or m.group(2) or ',', value)
+
+
+def minify_selector(selector):
+    return re.sub(rf'({CSS_STRING})|\s*([,>~+])\s*', lambda m: m.group(1) or m.group(2), selector)
+
+
+def minify_css(rules):
+    """Compact CSS text for parse_css rules, regrouping consecutive @media / @supports contexts"""
+    parts = []
+    context = ''
+    for rule_context, selector, declarations in rules:
+        if rule_context != context:
+            if context:
+                parts.append('}')
+            if rule_context:
+                parts.append(f"{rule_context}{{")
+            context = rule_context
+        if declarations is None:
+            parts.append(f"{selector};")
+        elif selector.startswith('@'):
+            # @font-face, @keyframes: nested blocks are kept as parsed
+            parts.append(f"{selector}{{{declarations}}}")
+        else:
+            body = ';'.join(f"{name}:{value}" for name, value in split_declarations(declarations))
+            parts.append(f"{minify_selector(selector)}{{{body}}}")
+    if context:
+        parts.append('}')
+    return ''.join(parts)
+
+
+def style_class_name(declarations):
+    """Stable class name for a normalized declaration block, so repeated passes agree"""
+    return STYLE_CLASS_PREFIX + hashlib.sha1(declarations.encode('utf-8')).hexdigest()[:6]
+
+
+def styles_to_classes(soup, important_families, min_reuse=MIN_STYLE_REUSE):
+    """Replace repeated style attributes with classes; returns (rules, elements changed)
+
+    The generated rules are !important so they still beat stylesheet rules the
+    way the inline style did. Styles touching a property family (background,
+    margin...) the stylesheet marks !important are left inline, since that
+    contest can't be reproduced.
+    """
+    by_style = {}
+    for tag in soup.find_all(style=True):
+        declarations = split_declarations(tag['style'])
+        if not declarations:
+            del tag['style']
+            continue
+        if families_overlap({property_family(name) for name, _ in declarations}, important_families):
+            continue
+        normalized = ';'.join(f"{name}:{value}" for name, value in declarations)
+        by_style.setdefault(normalized, []).append(tag)
+
+    rules = []
+    changed = 0
+    for normalized, tags in by_style.items():
+        if len(tags) < min_reuse:
+            continue
+        name = style_class_name(normalized)
+        body = '; '.join(declaration if declaration.endswith('!important') else f"{declaration} !important"
+                         for declaration in normalized.split(';'))
+        rules.append(('', f".{name}", body))
+        for tag in tags:
+            del tag['style']
+            tag['class'] = tag.get('class', []) + [name]
+            changed += 1
+    return rules, changed
+
+
+def fold_elements(soup, html_content, fold_bytes=FOLD_BYTES):
+    """<html>, <body> and the elements starting within fold_bytes of the body's start"""
+    body = soup.body
+    if body is None or body.sourceline is None:
+        return None
+    line_starts = [0] + [match.end() for match in re.finditer('\n', html_content)]
+
+    def offset(tag):
+        return line_starts[tag.sourceline - 1] + tag.sourcepos
+
+    fold_end = offset(body) + fold_bytes
+    elements = [tag for tag in (soup.html, body) if tag is not None]
+    for tag in body.find_all(True):
+        if tag.sourceline is not None and offset(tag) > fold_end:
+            break
+        elements.append(tag)
+    return elements
+
+
+def split_critical(rules, fold):
+    """(critical, deferred) rules: critical ones match an above-the-fold element
+
+    Deferred CSS comes after the critical CSS, so a critical rule that followed
+    a deferred rule setting a property of the same family (margin-top and
+    margin, say) is repeated in the deferred CSS, keeping the cascade order
+    for elements below the fold.
+    """
+    import soupsieve
+
+    classes = {name for tag in fold for name in tag.get('class', [])}
+    ids = {tag.get('id') for tag in fold}
+    names = {tag.name for tag in fold}
+    compiled = {}
+
+    def is_critical(selector, declarations):
+        if declarations is None or selector.startswith('@'):
+            return True
+        selector = DYNAMIC_PSEUDO_PATTERN.sub('', selector).strip()
+        if not selector:
+            return True
+        if '(' not in selector and not any(_may_match(part, classes, ids, names) for part in selector.split(',')):
+            return False
+        if selector not in compiled:
+            try:
+                compiled[selector] = soupsieve.compile(selector)
+            except Exception:
+                compiled[selector] = None
+        matcher = compiled[selector]
+        return matcher is None or any(matcher.match(tag) for tag in fold)
+
+    critical = []
+    deferred = []
+    deferred_families = set()
+    for rule in rules:
+        families = property_families(rule[2]) if not rule[1].startswith('@') else set()
+        if is_critical(rule[1], rule[2]):
+            critical.append(rule)
+            if families_overlap(families, deferred_families):
+                deferred.append(rule)
+        else:
+            deferred.append(rule)
+            deferred_families |= families
+    return critical, deferred
+
+
+def _may_match(part, classes, ids, names):
+    """Cheap prefilter: can the rightmost compound selector match any fold element?"""
+    compound = re.split(r'\s*[\s>+~]\s*', part.strip())[-1]
+    tag = re.match(r'[a-zA-Z][\w-]*', compound)
+    return (all(name in classes for name in re.findall(r'\.([\w-]+)', compound))
+            and all(name in ids for name in re.findall(r'#([\w-]+)', compound))
+            and (tag is None or tag.group(0).lower() in names))
+
+
+def collapse_whitespace(soup):
+    """Collapse whitespace runs in text to one space (rendering is unchanged outside <pre>)"""
+    from bs4 import NavigableString
+    for text in list(soup.find_all(string=True)):
+        if type(text) is not NavigableString or any(p.name in PRESERVE_WHITESPACE_TAGS for p in text.parents):
+            continue
+        collapsed = WHITESPACE_PATTERN.sub(' ', text)
+        if collapsed == ' ' and text.parent is not None and text.parent.name in ('html', 'head', '[document]'):
+            text.extract()
+        elif collapsed != text:
+            text.replace_with(collapsed)
+
+
+def optimize_html(html_content, fold_bytes=FOLD_BYTES):
+    """Smaller, equivalent HTML; returns (html, report)
+
+    report has input_bytes, output_bytes, saved_bytes and reduction (a
+    fraction), plus style_classes, styles_replaced, comments_removed,
+    critical_css_bytes and deferred_css_bytes. 'skipped' is set when the
+    original was returned.
+    """
+    from bs4 import BeautifulSoup, Comment
+
+    started = time.perf_counter()
+    with metrics.span('optimize_html') as span:
+        input_bytes = len(html_content.encode('utf-8'))
+        soup = BeautifulSoup(html_content, 'html.parser')
+        report = {'input_bytes': input_bytes}
+
+        comments = [comment for comment in soup.find_all(string=lambda s: isinstance(s, Comment))
+                    if not PROTECTED_COMMENT_PATTERN.match(comment)]
+        for comment in comments:
+            comment.extract()
+        report['comments_removed'] = len(comments)
+
+        styles = soup.find_all('style')
+        rules = parse_css('\n'.join(style.string or '' for style in styles))
+        important = {property_family(name) for _, _, declarations in rules
+                     if declarations and '!important' in declarations
+                     for name, value in split_declarations(declarations) if value.endswith('!important')}
+        class_rules, report['styles_replaced'] = styles_to_classes(soup, important)
+        report['style_classes'] = len(class_rules)
+        rules += class_rules
+
+        fold = fold_elements(soup, html_content, fold_bytes)
+        if fold is not None and soup.head is not None:
+            critical, deferred = split_critical(rules, fold)
+        else:
+            critical, deferred = rules, []
+        critical_css = minify_css(critical)
+        deferred_css = minify_css(deferred)
+        report['critical_css_bytes'] = len(critical_css.encode('utf-8'))
+        report['deferred_css_bytes'] = len(deferred_css.encode('utf-8'))
+
+        for style in styles[1:]:
+            style.decompose()
+        if critical_css:
+            critical_tag = soup.new_tag('style')
+            critical_tag.string = critical_css
+            if soup.head is not None:
+                soup.head.append(critical_tag)
+            elif styles:
+                styles[0].insert_after(critical_tag)
+            else:
+                # Never ahead of the doctype or the info comments
+                (soup.body or soup.html or soup).insert(0, critical_tag)
+        if styles:
+            styles[0].decompose()
+        if deferred_css:
+            deferred_tag = soup.new_tag('style')
+            deferred_tag.string = deferred_css
+            soup.body.append(deferred_tag)
+
+        inline_styles = ' '.join(tag['style'] for tag in soup.find_all(style=True))
+        if not PRESERVE_WHITESPACE_CSS.search(critical_css + deferred_css + inline_styles):
+            collapse_whitespace(soup)
+
+        optimized = str(soup)
+        if MARKER_PATTERN.findall(optimized) != MARKER_PATTERN.findall(html_content):
+            report['skipped'] = 'image markers changed'
+        elif extract_image_info(optimized) != extract_image_info(html_content):
+            report['skipped'] = 'image info changed'
+        elif len(optimized.encode('utf-8')) >= input_bytes:
+            report['skipped'] = 'no reduction'
+        if report.get('skipped'):
+            optimized = html_content
+
+        output_bytes = len(optimized.encode('utf-8'))
+        report.update(
+            output_bytes=output_bytes,
+            saved_bytes=input_bytes - output_bytes,
+            reduction=(input_bytes - output_bytes) / input_bytes if input_bytes else 0.0,
+            seconds=time.perf_counter() - started
+        )
+        span.set(input_bytes=input_bytes, output_bytes=output_bytes, skipped=report.get('skipped'))
+        metrics.incr('optimized_bytes_saved', report['saved_bytes'])
+    return optimized, report
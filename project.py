@@ -0,0 +1,293 @@
+# project.py
+"""Multi-page projects sharing one design system and one stylesheet"""
+import re
+import threading
+from collections import OrderedDict
+
+import metrics
+from main import extract_image_info
+from tiling import FENCE_PATTERN, PLACEHOLDER_ID_PATTERN, split_fragment
+
+STYLESHEET_NAME = 'styles.css'
+COMPONENT_TAGS = ('header', 'nav', 'footer')
+COMPONENT_MARKER_PATTERN = re.compile(r'<!-- COMPONENT:(\w+) -->')
+CSS_COMMENT_PATTERN = re.compile(r'/\*.*?\*/', re.DOTALL)
+# TOTAL_IMAGES and IMAGE_n info comments the model writes before the document
+INFO_COMMENTS_PATTERN = re.compile(r'\s*(?:<!-- (?:TOTAL_IMAGES:|IMAGE_\d+:).*?-->\s*)*', re.DOTALL)
+TITLE_PATTERN = re.compile(r'<title[^>]*>(.*?)</title>', re.DOTALL | re.IGNORECASE)
+# At-rules whose contents are ordinary rules and are merged rule by rule
+GROUPING_AT_RULES = ('@media', '@supports')
+
+
+def parse_css(css, context=''):
+    """[(context, selector, declarations)] for each rule, whitespace-normalized
+
+    Rules inside @media / @supports carry the at-rule's prelude as context.
+    Other at-rules (@keyframes, @font-face) are kept whole. Statements such as
+    @import have declarations=None.
+    """
+    css = CSS_COMMENT_PATTERN.sub('', css)
+    rules = []
+    position = 0
+    while position < len(css):
+        brace = css.find('{', position)
+        semicolon = css.find(';', position)
+        if semicolon != -1 and (brace == -1 or semicolon < brace):
+            statement = ' '.join(css[position:semicolon].split())
+            if statement:
+                rules.append((context, statement, None))
+            position = semicolon + 1
+            continue
+        if brace == -1:
+            break
+        prelude = ' '.join(css[position:brace].split())
+        end = _matching_brace(css, brace)
+        body = css[brace + 1:end]
+        if not context and prelude.lower().startswith(GROUPING_AT_RULES):
+            rules.extend(parse_css(body, prelude))
+        elif prelude:
+            rules.append((context, prelude, ' '.join(body.split())))
+        position = end + 1
+    return rules
+
+
+def _matching_brace(css, start):
+    depth = 0
+    for index in range(start, len(css)):
+        if css[index] == '{':
+            depth += 1
+        elif css[index] == '}':
+            depth -= 1
+            if depth == 0:
+                return index
+    # Truncated output: the block runs to the end
+    return len(css)
+
+
+def render_css(rules):
+    """CSS text for parse_css rules, one rule per line, regrouping consecutive contexts"""
+    lines = []
+    context = ''
+    for rule_context, selector, declarations in rules:
+        if rule_context != context:
+            if context:
+                lines.append('}')
+            if rule_context:
+                lines.append(f"{rule_context} {{")
+            context = rule_context
+        indent = '  ' if context else ''
+        if declarations is None:
+            lines.append(f"{indent}{selector};")
+        else:
+            lines.append(f"{indent}{selector} {{ {declarations} }}")
+    if context:
+        lines.append('}')
+    return '\n'.join(lines)
+
+
+class SharedStylesheet:
+    """Rules shared by every page of a project, keyed by (context, selector)"""
+
+    def __init__(self):
+        self.rules = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, rules):
+        """Share parse_css rules whose (context, selector) isn't shared yet"""
+        with self._lock:
+            for context, selector, declarations in rules:
+                self.rules.setdefault((context, selector), declarations)
+
+    def local_css(self, css):
+        """The part of a page's CSS the shared stylesheet doesn't already provide"""
+        with self._lock:
+            local = [rule for rule in parse_css(css) if self.rules.get(rule[:2], False) != rule[2]]
+        return render_css(local)
+
+    def text(self):
+        with self._lock:
+            return render_css([(context, selector, declarations)
+                               for (context, selector), declarations in self.rules.items()])
+
+
+def matches_markup(selector, soup):
+    """Whether a rule's selector could match an element of a parsed page
+
+    At-rules and statements never match elements; selectors soupsieve can't
+    handle count as matching, so they are never promoted.
+    """
+    import soupsieve
+    from optimize import DYNAMIC_PSEUDO_PATTERN
+    if selector.startswith('@'):
+        return False
+    selector = DYNAMIC_PSEUDO_PATTERN.sub('', selector).strip()
+    if not selector:
+        return True
+    try:
+        return soupsieve.select_one(selector, soup) is not None
+    except Exception:
+        return True
+
+
+def shared_candidates(page_rules, page_soups, shared, min_pages=2):
+    """Rules of later pages that are safe to move into the shared stylesheet
+
+    page_rules is a list of parse_css results, one per page. A rule qualifies
+    when it appears identically on min_pages pages, its selector isn't shared
+    already, and it matches nothing on the pages that don't carry it.
+    """
+    pages_with = OrderedDict()
+    for index, rules in enumerate(page_rules):
+        for rule in rules:
+            if rule[:2] not in shared:
+                pages_with.setdefault(rule, set()).add(index)
+    promoted = []
+    taken = set()
+    for rule, pages in pages_with.items():
+        if len(pages) < min_pages or rule[:2] in taken:
+            continue
+        if any(matches_markup(rule[1], soup) for index, soup in enumerate(page_soups) if index not in pages):
+            continue
+        promoted.append(rule)
+        taken.add(rule[:2])
+    return promoted
+
+
+def extract_components(markup, tags=COMPONENT_TAGS):
+    """{tag: markup} for the first top-level header/nav/footer of a page
+
+    Elements nested in an earlier component and elements containing image
+    placeholders are skipped; the ids of the latter belong to one page.
+    """
+    components = {}
+    taken = []
+    for tag in tags:
+        for match in re.finditer(rf'<{tag}\b[^>]*>.*?</{tag}>', markup, re.DOTALL | re.IGNORECASE):
+            if any(start <= match.start() and match.end() <= end for start, end in taken):
+                continue
+            if not PLACEHOLDER_ID_PATTERN.search(match.group(0)):
+                components[tag] = match.group(0)
+                taken.append(match.span())
+            break
+    return components
+
+
+def expand_components(markup, components):
+    """Replace COMPONENT markers with the shared markup; returns (markup, names expanded)"""
+    expanded = []
+
+    def expand(match):
+        name = match.group(1)
+        if name not in components:
+            return match.group(0)
+        expanded.append(name)
+        return components[name]
+
+    return COMPONENT_MARKER_PATTERN.sub(expand, markup), expanded
+
+
+def build_context_prompt(base_prompt, stylesheet_css, components):
+    """The page prompt extended with the project's design system"""
+    component_notes = ''.join(
+        f"\n            - If this page has this exact {name}, output only <!-- COMPONENT:{name} --> in its place:"
+        f"\n{markup}\n"
+        for name, markup in components.items()
+    )
+    return f"""{base_prompt}
+            PROJECT CONTEXT:
+            This page belongs to a multi-page project. Every page links this shared stylesheet:
+{stylesheet_css}
+
+            - Reuse its classes wherever this page matches the design system; do NOT repeat its rules
+            - Put only the rules this page needs beyond the shared stylesheet in one <style> block
+            - Give page-specific elements new class names instead of redefining shared ones{component_notes}
+            """
+
+
+class Project:
+    """Pages generated with a shared design system and assembled against one stylesheet
+
+    Call establish() with the first page's HTML before generating the others;
+    pages generated before that get the plain prompt.
+    """
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.stylesheet = SharedStylesheet()
+        self.components = {}
+        self.context_css = None
+
+    def establish(self, html_content):
+        """Take the design system (CSS and components) from a generated page"""
+        css, markup = split_fragment(html_content)
+        self.stylesheet.add(parse_css(css))
+        self.context_css = self.stylesheet.text()
+        self.components = extract_components(markup)
+
+    def build_prompt(self, image_width, image_height):
+        prompt = self.generator.build_prompt(image_width, image_height)
+        if self.context_css is None:
+            return prompt
+        return build_context_prompt(prompt, self.context_css, self.components)
+
+    def generate_page(self, payload, image_width, image_height, use_cache=True):
+        """Raw HTML for one page from its HTMLGenerator.prepare_image payload
+
+        Pages are prompted with the design system once it is established.
+        """
+        with metrics.span('project_page', context=self.context_css is not None) as span:
+            html = self.generator.generate_html_with_image_placeholders(
+                payload['data'], image_width, image_height, use_cache=use_cache,
+                mime_type=payload['mime_type'], prompt=self.build_prompt(image_width, image_height)
+            )
+            span.set(response_bytes=len(html.encode('utf-8')))
+        return html
+
+    def assemble_pages(self, pages):
+        """Lean pages linking the shared stylesheet, for the raw HTML of every page
+
+        Returns [(page_html, image_info, stats)] in the same order. Rules
+        repeated across pages are promoted to the stylesheet first (see
+        shared_candidates), so call this once with all pages.
+        """
+        from bs4 import BeautifulSoup
+        parts = [self._split_page(html_content) for html_content in pages]
+        page_rules = [parse_css(part['css']) for part in parts]
+        page_soups = [BeautifulSoup(part['markup'], 'html.parser') for part in parts]
+        self.stylesheet.add(shared_candidates(page_rules, page_soups, self.stylesheet.rules))
+        return [self._render_page(part) for part in parts]
+
+    def _split_page(self, html_content):
+        html_content = FENCE_PATTERN.sub('', html_content)
+        css, markup = split_fragment(html_content)
+        # Fragments without <body> still start with the info comments
+        markup = markup[INFO_COMMENTS_PATTERN.match(markup).end():]
+        markup, expanded = expand_components(markup, self.components)
+        title = TITLE_PATTERN.search(html_content)
+        return {
+            'html': html_content,
+            'header': INFO_COMMENTS_PATTERN.match(html_content).group(0).strip(),
+            'title': title.group(1).strip() if title else None,
+            'css': css,
+            'markup': markup,
+            'components': expanded
+        }
+
+    def _render_page(self, part):
+        local_css = self.stylesheet.local_css(part['css'])
+        head = ['<meta charset="utf-8">',
+                '<meta name="viewport" content="width=device-width, initial-scale=1">']
+        if part['title']:
+            head.append(f"<title>{part['title']}</title>")
+        head.append(f'<link rel="stylesheet" href="{STYLESHEET_NAME}">')
+        if local_css:
+            head.append(f"<style>\n{local_css}\n</style>")
+        page = (f"{part['header']}\n<!DOCTYPE html>\n<html>\n<head>\n" + '\n'.join(head)
+                + f"\n</head>\n<body>\n{part['markup']}\n</body>\n</html>").lstrip()
+        stats = {
+            'response_bytes': len(part['html'].encode('utf-8')),
+            'page_bytes': len(page.encode('utf-8')),
+            'local_css_bytes': len(local_css.encode('utf-8')),
+            'components': part['components']
+        }
+        return page, extract_image_info(part['html']), stats
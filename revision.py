@@ -0,0 +1,182 @@
+# revision.py
+"""Regenerate only the regions of a revised mockup that changed"""
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from images import read_image_bytes
+from tiling import (BAND_CSS_PATTERN, BAND_OVERLAP, PLACEHOLDER_ID_PATTERN, SECTION_PATTERN, TOTAL_IMAGES_PATTERN,
+                    crop_bands, split_fragment, wrap_band_css, wrap_section)
+
+# Block size in pixels and the mean-luminance difference treated as a change;
+# the tolerance absorbs re-export/compression noise.
+BLOCK_SIZE = 16
+CHANGE_THRESHOLD = 6.0
+# Full regenerations are tiled into about this many sections (never shorter
+# than MIN_REVISION_BAND_HEIGHT) so ordinary pages can be revised in parts too
+REVISION_SECTIONS = 4
+MIN_REVISION_BAND_HEIGHT = 320
+
+
+def block_signatures(image_file, block=BLOCK_SIZE):
+    """Mean luminance of every block x block tile, as a (rows, cols) array"""
+    import numpy as np
+    from PIL import Image
+    image = Image.open(io.BytesIO(read_image_bytes(image_file))).convert('L')
+    pixels = np.asarray(image, dtype=np.float32)
+    height, width = pixels.shape
+    rows, cols = -(-height // block), -(-width // block)
+    # Edge-pad to whole blocks so every pixel belongs to exactly one tile
+    pixels = np.pad(pixels, ((0, rows * block - height), (0, cols * block - width)), mode='edge')
+    return pixels.reshape(rows, block, cols, block).mean(axis=(1, 3))
+
+
+def changed_row_ranges(previous_file, revised_file, block=BLOCK_SIZE, threshold=CHANGE_THRESHOLD):
+    """(top, bottom) pixel ranges of block rows that differ between two same-size mockups"""
+    import numpy as np
+    previous = block_signatures(previous_file, block)
+    revised = block_signatures(revised_file, block)
+    changed_rows = np.flatnonzero((np.abs(previous - revised) > threshold).any(axis=1))
+    if changed_rows.size == 0:
+        return []
+    # Split into runs of consecutive block rows
+    breaks = np.flatnonzero(np.diff(changed_rows) > 1)
+    starts = np.concatenate(([changed_rows[0]], changed_rows[breaks + 1]))
+    ends = np.concatenate((changed_rows[breaks], [changed_rows[-1]]))
+    return [(int(start) * block, (int(end) + 1) * block) for start, end in zip(starts, ends)]
+
+
+def parse_sections(html_content):
+    """{index: (top, bottom, markup)} for every tiled section in the document"""
+    return {
+        int(match.group(1)): (int(match.group(2)), int(match.group(3)), match.group(4))
+        for match in SECTION_PATTERN.finditer(html_content)
+    }
+
+
+def image_ids_in_order(html_content):
+    """Placeholder ids in order of first appearance"""
+    ids = []
+    for match in PLACEHOLDER_ID_PATTERN.finditer(html_content):
+        img_id = int(match.group(2))
+        if img_id not in ids:
+            ids.append(img_id)
+    return ids
+
+
+def remap_placeholders(html_content, mapping):
+    """Rewrite placeholder ids through mapping {old_id: new_id}"""
+    def replace(match):
+        new_id = mapping.get(int(match.group(2)), int(match.group(2)))
+        return f"<!-- IMAGE_{match.group(1) or ''}{new_id}{match.group(3)}"
+    return PLACEHOLDER_ID_PATTERN.sub(replace, html_content)
+
+
+def revision_band_height(image_height, sections=REVISION_SECTIONS, overlap=BAND_OVERLAP):
+    """Band height that splits a page into about `sections` overlapping sections"""
+    return max(MIN_REVISION_BAND_HEIGHT, -(-(image_height + overlap * (sections - 1)) // sections))
+
+
+def image_size(image_file):
+    from PIL import Image
+    return Image.open(io.BytesIO(read_image_bytes(image_file))).size
+
+
+def revise(generator, previous_html, previous_file, revised_file, image_width, image_height,
+           use_cache=True, max_workers=8):
+    """Regenerate the sections of previous_html whose rows changed in revised_file
+
+    Falls back to a full tiled generation (so the next revision can be
+    incremental) when the previous HTML has no section markers or the page
+    size changed. Its image areas are then renumbered onto the previous
+    document's ids by position and size, reported under 'reconcile'.
+    Returns (html, report).
+    """
+    started = time.perf_counter()
+    sections = parse_sections(previous_html)
+    report = {'mode': 'incremental', 'sections': len(sections), 'regenerated': [], 'changed_rows': [], 'reason': ''}
+
+    if not sections:
+        report['reason'] = "previous HTML has no section markers"
+    elif image_size(previous_file) != image_size(revised_file):
+        report['reason'] = "page size changed"
+    if report['reason']:
+        report['mode'] = 'full'
+        # Imported here: cascade imports this module through main
+        from cascade import reconcile_placeholders
+        html = generator.generate_html_tiled(revised_file, image_width, image_height, use_cache=use_cache,
+                                             band_height=revision_band_height(image_height),
+                                             max_workers=max_workers)
+        html, report['reconcile'] = reconcile_placeholders(previous_html, html)
+        report['sections'] = len(parse_sections(html))
+        report['regenerated'] = sorted(parse_sections(html))
+        report['seconds'] = time.perf_counter() - started
+        return html, report
+
+    changed = changed_row_ranges(previous_file, revised_file)
+    report['changed_rows'] = changed
+    report['changed_fraction'] = sum(bottom - top for top, bottom in changed) / max(1, image_height)
+    targets = sorted(
+        index for index, (top, bottom, _) in sections.items()
+        if any(top < changed_bottom and changed_top < bottom for changed_top, changed_bottom in changed)
+    )
+    report['regenerated'] = targets
+    if not targets:
+        report['mode'] = 'unchanged'
+        report['seconds'] = time.perf_counter() - started
+        return previous_html, report
+
+    bands = crop_bands(revised_file, [sections[index][:2] for index in targets])
+
+    def generate(position):
+        index = targets[position]
+        return generator.generate_band(bands[position], image_width, image_height, sections[index][:2],
+                                       index, len(sections), BAND_OVERLAP, use_cache)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(targets))) as pool:
+        fragments = dict(zip(targets, pool.map(generate, range(len(targets)))))
+
+    html = splice_sections(previous_html, sections, fragments)
+    report['seconds'] = time.perf_counter() - started
+    return html, report
+
+
+def splice_sections(previous_html, sections, fragments):
+    """Swap regenerated fragments into their sections, reusing the old IMAGE_n ids
+
+    The k-th image of a regenerated section takes the k-th id the section had
+    before; extra images get fresh ids after the highest id in the document.
+    """
+    next_id = max(image_ids_in_order(previous_html), default=0)
+    replacements = {}
+    css_replacements = {}
+    for index, fragment in fragments.items():
+        css, markup = split_fragment(fragment)
+        old_ids = image_ids_in_order(sections[index][2])
+        mapping = {}
+        for position, local_id in enumerate(image_ids_in_order(markup)):
+            if position < len(old_ids):
+                mapping[local_id] = old_ids[position]
+            else:
+                next_id += 1
+                mapping[local_id] = next_id
+        replacements[index] = remap_placeholders(markup, mapping)
+        css_replacements[index] = css
+
+    def replace_section(match):
+        index = int(match.group(1))
+        if index not in replacements:
+            return match.group(0)
+        return wrap_section(index, match.group(2), match.group(3), replacements[index])
+
+    def replace_css(match):
+        index = int(match.group(1))
+        if index not in css_replacements:
+            return match.group(0)
+        return wrap_band_css(index, css_replacements[index])
+
+    html = SECTION_PATTERN.sub(replace_section, previous_html)
+    html = BAND_CSS_PATTERN.sub(replace_css, html)
+    # Same convention as stitch_sections: the count is the highest id in use
+    total = max(image_ids_in_order(html), default=0)
+    return TOTAL_IMAGES_PATTERN.sub(f"<!-- TOTAL_IMAGES:{total} -->", html, count=1)
@@ -0,0 +1,232 @@
+# similarity.py
+"""Perceptual-hash index of previously analyzed mockups"""
+import hashlib
+import io
+import itertools
+import json
+import os
+import threading
+import time
+
+from cache import atomic_write
+from images import read_image_bytes
+
+DEFAULT_INDEX_DIR = os.environ.get("MOCKUP_SIMILARITY_DIR", os.path.join(".cache", "similar"))
+# Hamming distance (out of 64 bits) still treated as the same design
+DEFAULT_MAX_DISTANCE = int(os.environ.get("MOCKUP_SIMILARITY_DISTANCE", "6"))
+# pHash ignores aspect ratio, so pages of clearly different proportions never match
+MAX_ASPECT_DIFFERENCE = 0.05
+
+HASH_SIZE = 8
+PHASH_SAMPLE = 32
+
+
+def _dct_matrix(size):
+    """Orthonormal DCT-II basis, so a 2-D DCT is two matrix products"""
+    import numpy as np
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    basis = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    basis[0] /= np.sqrt(2)
+    return basis
+
+
+def _to_int(bits):
+    import numpy as np
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def image_hashes(image_file):
+    """(phash, dhash, width, height) of a mockup, decoding it once"""
+    import numpy as np
+    from PIL import Image
+    image = Image.open(io.BytesIO(read_image_bytes(image_file)))
+    width, height = image.size
+    # Both hashes only need a tiny thumbnail; let JPEG decode at reduced scale
+    image.draft('L', (PHASH_SAMPLE * 4, PHASH_SAMPLE * 4))
+    gray = image.convert('L')
+
+    sample = np.asarray(gray.resize((PHASH_SAMPLE, PHASH_SAMPLE), Image.LANCZOS), dtype=np.float64)
+    dct = _dct_matrix(PHASH_SAMPLE)
+    low = (dct @ sample @ dct.T)[:HASH_SIZE, :HASH_SIZE]
+    # The DC term only carries overall brightness; leave it out of the median
+    phash = _to_int(low > np.median(low.ravel()[1:]))
+
+    sample = np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    dhash = _to_int(sample[:, 1:] > sample[:, :-1])
+    return phash, dhash, width, height
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class MultiIndexHash:
+    """Multi-index hashing of 64-bit hashes under Hamming distance
+
+    Each hash is split into CHUNKS 16-bit substrings with a table per
+    substring. Two hashes within distance r differ by at most r // CHUNKS bits
+    in at least one substring (pigeonhole), so a query only probes the buckets
+    within that many bit flips of each of its own substrings.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self):
+        self.tables = [{} for _ in range(self.CHUNKS)]
+        self.values = {}
+
+    def _chunks(self, value):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def add(self, value, item):
+        self.values[item] = value
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            table.setdefault(chunk, []).append(item)
+
+    def search(self, value, radius):
+        """[(distance, item)] for every item within radius of value"""
+        flips = [0]
+        for count in range(1, radius // self.CHUNKS + 1):
+            flips.extend(sum(1 << bit for bit in bits)
+                         for bits in itertools.combinations(range(self.CHUNK_BITS), count))
+        seen = set()
+        results = []
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            for flip in flips:
+                for item in table.get(chunk ^ flip, ()):
+                    if item in seen:
+                        continue
+                    seen.add(item)
+                    distance = hamming(value, self.values[item])
+                    if distance <= radius:
+                        results.append((distance, item))
+        return results
+
+
+class SimilarityIndex:
+    """Persistent mockup -> generated HTML index keyed by perceptual hash"""
+
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR, max_distance=DEFAULT_MAX_DISTANCE, enabled=None):
+        self.index_dir = index_dir
+        self.max_distance = max_distance
+        if enabled is None:
+            # MOCKUP_SIMILARITY=0 switches lookups and indexing off
+            enabled = os.environ.get("MOCKUP_SIMILARITY", "1") != "0"
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.entries = {}
+        self.table = MultiIndexHash()
+        self._lock = threading.Lock()
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._load()
+
+    @property
+    def _log_path(self):
+        return os.path.join(self.index_dir, "index.jsonl")
+
+    def _path(self, entry_id):
+        return os.path.join(self.index_dir, f"{entry_id}.html")
+
+    def _load(self):
+        try:
+            with open(self._log_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A torn final line from an interrupted write
+                continue
+            self._insert(entry)
+
+    def _insert(self, entry):
+        if entry['id'] in self.entries:
+            self.entries[entry['id']].update(entry)
+            return
+        self.entries[entry['id']] = entry
+        self.table.add(int(entry['phash'], 16), entry['id'])
+
+    def find(self, image_file, max_distance=None, hashes=None):
+        """Closest stored design within max_distance, or None
+
+        Returns a dict with the entry's id, distance, width, height and
+        model; read_html() loads its HTML. Pass hashes from image_hashes()
+        to avoid decoding twice.
+        """
+        if not self.enabled:
+            return None
+        max_distance = self.max_distance if max_distance is None else max_distance
+        phash, dhash, width, height = hashes or image_hashes(image_file)
+        aspect = width / height
+        candidates = []
+        with self._lock:
+            for distance, entry_id in self.table.search(phash, max_distance):
+                entry = self.entries[entry_id]
+                if abs(entry['width'] / entry['height'] / aspect - 1) > MAX_ASPECT_DIFFERENCE:
+                    continue
+                # Rank by both hashes; the dHash breaks ties between equally close pHashes
+                candidates.append((distance + hamming(dhash, int(entry['dhash'], 16)), distance, entry))
+        for _, distance, entry in sorted(candidates, key=lambda candidate: candidate[0]):
+            if not os.path.exists(self._path(entry['id'])):
+                continue
+            with self._lock:
+                self.hits += 1
+            return dict(entry, distance=distance)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def read_html(self, entry_id):
+        """The HTML stored for an entry, or None if it has been cleared since"""
+        try:
+            with open(self._path(entry_id), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def add(self, image_file, html, model_name, hashes=None):
+        """Remember the HTML generated for a mockup"""
+        if not self.enabled:
+            return None
+        phash, dhash, width, height = hashes or image_hashes(image_file)
+        entry = {
+            'id': hashlib.sha256(read_image_bytes(image_file)).hexdigest()[:16],
+            'phash': f"{phash:016x}",
+            'dhash': f"{dhash:016x}",
+            'width': width,
+            'height': height,
+            'model': model_name,
+            'ts': round(time.time(), 3)
+        }
+        atomic_write(self._path(entry['id']), html)
+        with self._lock:
+            with open(self._log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+            self._insert(entry)
+        return entry
+
+    def clear(self):
+        """Forget every stored design"""
+        with self._lock:
+            for name in os.listdir(self.index_dir):
+                if name.endswith('.html') or name == "index.jsonl":
+                    try:
+                        os.remove(os.path.join(self.index_dir, name))
+                    except OSError:
+                        pass
+            self.entries = {}
+            self.table = MultiIndexHash()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.entries),
+            'enabled': self.enabled
+        }
@@ -0,0 +1,150 @@
+# tiling.py
+"""Split very tall mockups into overlapping bands and stitch the generated sections"""
+import io
+import re
+
+from images import ImageFile, read_image_bytes
+
+# Mockups taller than this multiple of their width are worth tiling
+TALL_RATIO = 2.5
+# Band height as a multiple of the width, and overlap between bands in pixels
+BAND_ASPECT = 1.0
+MIN_BAND_HEIGHT = 1024
+BAND_OVERLAP = 120
+
+SECTION_PATTERN = re.compile(
+    r'<!-- SECTION_START_(\d+): top=(\d+) bottom=(\d+) -->\n?(.*?)\n?<!-- SECTION_END_\1 -->', re.DOTALL
+)
+BAND_CSS_PATTERN = re.compile(r'/\* BAND_CSS_START_(\d+) \*/\n?(.*?)\n?/\* BAND_CSS_END_\1 \*/', re.DOTALL)
+STYLE_PATTERN = re.compile(r'<style[^>]*>(.*?)</style>', re.DOTALL | re.IGNORECASE)
+BODY_PATTERN = re.compile(r'<body[^>]*>(.*?)</body>', re.DOTALL | re.IGNORECASE)
+FENCE_PATTERN = re.compile(r'^\s*```(?:html)?\s*|\s*```\s*$', re.IGNORECASE)
+PLACEHOLDER_ID_PATTERN = re.compile(r'<!-- IMAGE_(START_|END_)?(\d+)(:| -->)')
+TOTAL_IMAGES_PATTERN = re.compile(r'<!-- TOTAL_IMAGES:\d+ -->')
+
+
+def is_tall(width, height, ratio=TALL_RATIO):
+    """Whether a mockup is tall enough to benefit from tiled analysis"""
+    return width > 0 and height > width * ratio
+
+
+def band_bounds(width, height, band_height=None, overlap=BAND_OVERLAP):
+    """(top, bottom) pixel ranges of overlapping horizontal bands covering the page"""
+    band_height = band_height or max(MIN_BAND_HEIGHT, int(width * BAND_ASPECT))
+    if height <= band_height:
+        return [(0, height)]
+    bounds = []
+    top = 0
+    while True:
+        bottom = min(height, top + band_height)
+        bounds.append((top, bottom))
+        if bottom >= height:
+            return bounds
+        top = bottom - overlap
+
+
+def crop_bands(image_file, bounds):
+    """Crop each band out of the mockup as a lossless PNG ImageFile"""
+    from PIL import Image
+    image = Image.open(io.BytesIO(read_image_bytes(image_file)))
+    image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    bands = []
+    for index, (top, bottom) in enumerate(bounds, start=1):
+        buffer = io.BytesIO()
+        image.crop((0, top, image.width, bottom)).save(buffer, format='PNG')
+        bands.append(ImageFile(buffer.getvalue(), f"band-{index}.png", 'image/png'))
+    return bands
+
+
+def build_band_prompt(width, height, top, bottom, index, count, overlap):
+    """Prompt for one band; images are numbered locally and renumbered when stitching"""
+    overlap_note = ""
+    if index > 1:
+        overlap_note = (f"- The top {overlap}px of this band repeat the bottom of the previous band. "
+                        f"Do NOT recreate elements that start inside that overlap zone.\n            ")
+    return f"""
+            This image is band {index} of {count} of a tall {width}x{height} pixel web page design.
+            It covers the vertical range y={top}px to y={bottom}px of the full page and is {width}x{bottom - top} pixels.
+
+            Create EXACT HTML for ONLY this band, matching the design pixel-perfect.
+            - Preserve the layout, spacing, colors, typography and text exactly as shown
+            {overlap_note}- Output a single <section class="band-{index}"> fragment followed by nothing else
+            - Put all CSS in one <style> block before the section and prefix every selector with .band-{index}
+            - Do NOT output <html>, <head> or <body> tags
+
+            IMAGE AREAS:
+            - Identify ALL images, photos, graphics in this band
+            - For each image: <!-- IMAGE_1: width=300 height=200 description -->
+            - Then: <!-- IMAGE_START_1 --><div class="image-placeholder">...</div><!-- IMAGE_END_1 -->
+            - Number images from 1 within this band
+
+            Output ONLY the HTML code.
+            """
+
+
+def renumber_placeholders(html_content, offset):
+    """Shift every IMAGE_n / IMAGE_START_n / IMAGE_END_n id by offset
+
+    Returns (html, highest_new_id). Ids are made globally unique across
+    bands while staying in the format extract_image_info expects.
+    """
+    highest = offset
+
+    def shift(match):
+        nonlocal highest
+        new_id = int(match.group(2)) + offset
+        highest = max(highest, new_id)
+        return f"<!-- IMAGE_{match.group(1) or ''}{new_id}{match.group(3)}"
+
+    html_content = PLACEHOLDER_ID_PATTERN.sub(shift, html_content)
+    return html_content, highest
+
+
+def split_fragment(html_content):
+    """Separate a generated band into (css, markup), dropping fences and document wrappers"""
+    html_content = FENCE_PATTERN.sub('', html_content)
+    css = '\n'.join(block.strip() for block in STYLE_PATTERN.findall(html_content))
+    markup = STYLE_PATTERN.sub('', html_content)
+    body = BODY_PATTERN.search(markup)
+    if body:
+        markup = body.group(1)
+    markup = re.sub(r'<!DOCTYPE[^>]*>|</?html[^>]*>|<head[^>]*>.*?</head>', '', markup, flags=re.DOTALL | re.IGNORECASE)
+    markup = TOTAL_IMAGES_PATTERN.sub('', markup)
+    return css, markup.strip()
+
+
+def stitch_sections(fragments, bounds):
+    """Combine per-band HTML into one document with globally unique image ids
+
+    Each band is wrapped in SECTION_START_k/SECTION_END_k markers recording
+    the pixel range it was generated from, and its CSS in BAND_CSS markers.
+    """
+    styles = []
+    sections = []
+    next_id = 0
+    for index, (fragment, (top, bottom)) in enumerate(zip(fragments, bounds), start=1):
+        css, markup = split_fragment(fragment)
+        markup, next_id = renumber_placeholders(markup, next_id)
+        styles.append(wrap_band_css(index, css))
+        sections.append(wrap_section(index, top, bottom, markup))
+    return assemble_document(styles, sections, next_id)
+
+
+def wrap_section(index, top, bottom, markup):
+    """Section markers record the pixel range a band was generated from"""
+    return f"<!-- SECTION_START_{index}: top={top} bottom={bottom} -->\n{markup}\n<!-- SECTION_END_{index} -->"
+
+
+def wrap_band_css(index, css):
+    """Per-band CSS markers let a single band's styles be swapped later"""
+    return f"/* BAND_CSS_START_{index} */\n{css}\n/* BAND_CSS_END_{index} */"
+
+
+def assemble_document(styles, sections, total_images):
+    """Wrap stitched styles and sections in a single HTML document"""
+    style_block = '\n'.join(styles)
+    body = '\n'.join(sections)
+    return (f"<!-- TOTAL_IMAGES:{total_images} -->\n"
+            "<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+            "<meta name=\"viewport\" content=\"width=device-width, initial-scale=1\">\n"
+            f"<style>\nbody {{ margin: 0; }}\n{style_block}\n</style>\n</head>\n<body>\n{body}\n</body>\n</html>")